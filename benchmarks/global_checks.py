@@ -0,0 +1,92 @@
+"""
+Micro-benchmark for the config part of utils.checks.global_checks.
+
+Compares the old list scans over a guild's config against the compiled
+GuildIndex lookups in ConfigManager.
+
+    python -m benchmarks.global_checks
+"""
+import timeit
+from types import SimpleNamespace
+
+from cogs.bulbe.config import ConfigManager
+
+
+GUILD_ID = 1
+N_IGNORED = 50
+N_ROLES = 25
+N_AUTHOR_ROLES = 20
+NUMBER = 100000
+
+
+def legacy_checks(config, ctx):
+    """The pre-index logic: command_disabled, config_perm_check('administrator'), is_ignored."""
+    disabled = config['disabled']
+    if ctx.cog.qualified_name in disabled['modules'] or ctx.command.qualified_name in disabled['commands']:
+        return False
+    roles_users = config['roles']['administrator']
+    if ctx.author.id in roles_users:
+        return True
+    for role in ctx.author.roles:
+        if role.id in roles_users:
+            return True
+    ignored = config['ignored']
+    if ctx.channel.id in ignored['channels'] or ctx.author.id in ignored['users']:
+        return False
+    for role in ctx.author.roles:
+        if role.id in ignored['roles']:
+            return False
+    return True
+
+
+def indexed_checks(manager, ctx):
+    if manager.command_disabled(ctx):
+        return False
+    if manager.has_permission(ctx, 'administrator'):
+        return True
+    if manager.is_ignored(ctx):
+        return False
+    return True
+
+
+def make_fixture():
+    bot = SimpleNamespace(table=None, config_cache=None, get_guild=lambda guild_id: None)
+    cog = SimpleNamespace(logger=None)
+    manager = ConfigManager(bot, cog)
+    config = manager.edit_config(GUILD_ID)
+    config.update({
+        'ignored': {
+            'channels': list(range(1000, 1000 + N_IGNORED)),
+            'users': list(range(2000, 2000 + N_IGNORED)),
+            'roles': list(range(3000, 3000 + N_IGNORED)),
+        },
+        'disabled': {
+            'modules': [f'Module{i}' for i in range(N_ROLES)],
+            'commands': [f'command{i}' for i in range(N_ROLES)],
+        },
+        'roles': {
+            'administrator': list(range(4000, 4000 + N_ROLES)),
+            'moderator': list(range(5000, 5000 + N_ROLES)),
+        },
+    })
+    ctx = SimpleNamespace(
+        guild=SimpleNamespace(id=GUILD_ID),
+        channel=SimpleNamespace(id=1),
+        author=SimpleNamespace(id=2, roles=[SimpleNamespace(id=9000 + i) for i in range(N_AUTHOR_ROLES)]),
+        cog=SimpleNamespace(qualified_name='Utilities'),
+        command=SimpleNamespace(qualified_name='serverinfo'),
+    )
+    return manager, config, ctx
+
+
+def main():
+    manager, config, ctx = make_fixture()
+    assert legacy_checks(config, ctx) == indexed_checks(manager, ctx)
+    legacy = timeit.timeit(lambda: legacy_checks(config, ctx), number=NUMBER)
+    indexed = timeit.timeit(lambda: indexed_checks(manager, ctx), number=NUMBER)
+    print(f"legacy list scans: {legacy / NUMBER * 1e6:.2f} us/invocation")
+    print(f"compiled index:    {indexed / NUMBER * 1e6:.2f} us/invocation")
+
+
+if __name__ == "__main__":
+    main()
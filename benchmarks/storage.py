@@ -0,0 +1,142 @@
+"""
+Replays the bots' storage workloads against a local utils.storage backend,
+to measure utils.db.Table hot paths without AWS.
+
+    config   - Bulbe startup read of every guild config, then write-behind flushes of edited configs
+    persist  - role persist on member leave/join, against one guild-wide rolePersist item (the old
+               layout) and against per-member items (PersistManager)
+    devData  - Juan's FanClub lookups (full read + linear search) and bot registration
+
+    python -m benchmarks.storage [memory|sqlite:<path>]
+
+Latency comes from the local backend, so compare runs against each other, not against DynamoDB.
+Capacity units are estimated the way DynamoDB bills them, and do carry over.
+"""
+import sys
+import copy
+import random
+import time
+
+from cogs.bulbe.config import DEFAULT_CONFIG
+from utils.db import Table
+from utils.storage import open_backend
+
+
+N_GUILDS = 2000
+FLUSHES = 50
+# the guild-wide item hits DynamoDB's 400KB item limit at around 6500 members
+N_MEMBERS = (100, 5000)
+PERSIST_EVENTS = 200
+N_DEVS = 300
+DEVDATA_LOOKUPS = 200
+
+
+def run(name, table, workload, *args, setup=None):
+    """Runs a workload (after its untimed setup), then prints its wall time and the calls and capacity it used."""
+    if setup:
+        setup(table, *args)
+    before = {operation: (s['calls'], s['capacity']) for operation, s in table.stats().items()}
+    started = time.perf_counter()
+    ops = workload(table, *args)
+    elapsed = time.perf_counter() - started
+    calls = capacity = 0
+    for operation, s in table.stats().items():
+        previous_calls, previous_capacity = before.get(operation, (0, 0))
+        calls += s['calls'] - previous_calls
+        capacity += s['capacity'] - previous_capacity
+    print(f"{name:<32} {ops:>6} ops  {elapsed / ops * 1000:>8.3f} ms/op  "
+          f"{calls / ops:>6.2f} calls/op  {capacity / ops:>8.2f} units/op")
+
+
+def config_workload(table):
+    configs = {guild_id: copy.deepcopy(DEFAULT_CONFIG) for guild_id in range(1, N_GUILDS + 1)}
+    table.write_from_dict(configs, 'config')
+    data = table.read_to_dict('config')
+    assert len(data) == N_GUILDS
+    for _ in range(FLUSHES):
+        # a flush writes every guild edited since the last one (FLUSH_THRESHOLD is 25)
+        dirty = random.sample(list(data), 25)
+        items = []
+        for guild_id in dirty:
+            item = copy.deepcopy(data[guild_id])
+            item['prefix'] = random.choice(['!', '?', '+'])
+            item[table.primary_key] = guild_id
+            items.append(item)
+        table.write(items, 'config')
+    return 1 + FLUSHES
+
+
+def persist_setup(table, n_members):
+    # members who left earlier, with a handful of roles each
+    table.put({str(member_id): [random.randrange(10**17, 10**18) for _ in range(5)] for member_id in range(n_members)},
+              [n_members, 'rolePersist'])
+
+
+def persist_workload(table, n_members):
+    guild_id = n_members
+    for _ in range(PERSIST_EVENTS // 2):
+        member_id = str(random.randrange(n_members, n_members * 2))
+        # leave: PersistManager.put
+        data = table.get([guild_id, 'rolePersist'])
+        data[member_id] = [random.randrange(10**17, 10**18) for _ in range(5)]
+        table.put(data, [guild_id, 'rolePersist'])
+        # join: PersistManager.get
+        data = table.get([guild_id, 'rolePersist'])
+        data.pop(member_id)
+        table.put(data, [guild_id, 'rolePersist'])
+    return PERSIST_EVENTS
+
+
+def persist_member_setup(table, n_members):
+    table.write([{table.primary_key: n_members, table.sort_key: f"rolePersist-{member_id}",
+                  'roles': [random.randrange(10**17, 10**18) for _ in range(5)]} for member_id in range(n_members)])
+
+
+def persist_member_workload(table, n_members):
+    guild_id = n_members
+    for _ in range(PERSIST_EVENTS // 2):
+        member_id = random.randrange(n_members, n_members * 2)
+        # leave, then join
+        table.put({'roles': [random.randrange(10**17, 10**18) for _ in range(5)]}, [guild_id, f"rolePersist-{member_id}"])
+        table.pop([guild_id, f"rolePersist-{member_id}"])
+    return PERSIST_EVENTS
+
+
+def devdata_setup(table):
+    for user_id in range(1, N_DEVS + 1):
+        table.put({'bots': [{'id': user_id * 10 + i, 'prefix': '!'} for i in range(2)],
+                   'devChannel': user_id * 100, 'botRole': user_id * 1000}, [user_id, 'devData'])
+
+
+def devdata_workload(table):
+    for _ in range(DEVDATA_LOOKUPS):
+        # DevData.get_bot: read every devData item and search them
+        bot_id = random.randrange(1, N_DEVS + 1) * 10
+        owner = None
+        for user_data in table.read('devData'):
+            if any(bot['id'] == bot_id for bot in user_data['bots']):
+                owner = user_data[table.primary_key]
+                break
+        assert owner is not None
+        # FanClub.register_bot: read-modify-write the owner's item
+        data = table.get([owner, 'devData'])
+        data['bots'].append({'id': bot_id + 5, 'prefix': '?'})
+        table.put(data, [owner, 'devData'])
+    return DEVDATA_LOOKUPS
+
+
+def main():
+    spec = sys.argv[1] if len(sys.argv) > 1 else 'memory'
+    random.seed(0)
+    table = Table('Benchmark', backend=open_backend(spec))
+    print(f"Backend: {spec}")
+    run("config (startup read + flushes)", table, config_workload)
+    for n_members in N_MEMBERS:
+        run(f"persist ({n_members} stored members)", table, persist_workload, n_members, setup=persist_setup)
+        run(f"persist per member ({n_members})", table, persist_member_workload, n_members, setup=persist_member_setup)
+    run(f"devData ({N_DEVS} devs)", table, devdata_workload, setup=devdata_setup)
+    table.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,40 +3,53 @@ import discord
 from discord.ext import tasks, commands
 
 import random
+import asyncio
 
 # custom imports
 from bots.revbot import RevBot
 from utils.db import Table
+from utils.config_cache import ConfigCacheClient
 from utils import checks, utility
 
 
+# each blacklisted user or guild is its own item, keyed [id, BLACKLIST_SORT_KEYS[kind]]
+BLACKLIST_SORT_KEYS = {'user': 'userBlacklist', 'guild': 'guildBlacklist'}
+
+
 def prefix(bot, message, only_guild_prefix=False):
-    default = bot.properties.prefix if bot.properties else bot.default_prefix
+    default = bot.properties.prefix if bot.properties else bot._default_prefix
     if not message.guild:
         return commands.when_mentioned(bot, message) + [default]
+    if only_guild_prefix:
+        return guild_prefix(bot, message.guild)
+    else:
+        return bot.guild_prefixes(message.guild)
+
+
+def guild_prefix(bot, guild):
+    default = bot.properties.prefix if bot.properties else bot._default_prefix
     if bot.config:
-        config = bot.config.get_config(message.guild)
+        config = bot.config.get_config(guild)
         p = config['prefix']
     else:
         p = None
-    p = p if p else default
-    if only_guild_prefix:
-        return p
-    else:
-        return commands.when_mentioned(bot, message) + [p]
+    return p if p else default
 
 
 class Bulbe(RevBot):
-    def __init__(self, name, logger, **kwargs):
+    def __init__(self, name, logger, config_cache=None, **kwargs):
         super().__init__(name, logger=logger, command_prefix=prefix, case_insensitive=True,
                          description='Best Bot <3', **kwargs)
         self._init_args = [name, logger]
         self._init_kwargs = kwargs
         self._nwunder = None
         self.config = None
-        self._user_blacklist = []
-        self._guild_blacklist = []
+        self.config_cache = None
+        self._config_cache_path = config_cache
+        self._user_blacklist = set()
+        self._guild_blacklist = set()
         self._locked = False
+        self._prefixes = dict()
         self.table = None
         self.help_command = commands.MinimalHelpCommand()
         self.add_check(checks.global_checks)
@@ -58,7 +71,9 @@ class Bulbe(RevBot):
             return
         if message.guild:
             await self.process_mention(message)
-            await self.process_commands(message)
+            # skip building a Context for messages that can't be commands
+            if message.content.startswith(self.guild_prefixes(message.guild)):
+                await self.process_commands(message)
         else:
             await self.process_direct_messages(message)
 
@@ -81,6 +96,35 @@ class Bulbe(RevBot):
     def is_locked(self):
         return self._locked
 
+    def guild_prefixes(self, guild):
+        """Returns the cached tuple of prefixes (mentions, then guild prefix) for a guild."""
+        try:
+            return self._prefixes[guild.id]
+        except KeyError:
+            pass
+        prefixes = tuple(commands.when_mentioned(self, None)) + (guild_prefix(self, guild),)
+        self._prefixes[guild.id] = prefixes
+        return prefixes
+
+    def invalidate_prefix(self, guild_id=None):
+        """Drops the cached prefixes for a guild, or for every guild if no id is given."""
+        if guild_id is None:
+            self._prefixes.clear()
+        else:
+            self._prefixes.pop(guild_id, None)
+
+    def cache_sizes(self):
+        sizes = super().cache_sizes()
+        sizes['prefixes'] = len(self._prefixes)
+        sizes['user blacklist'] = len(self._user_blacklist)
+        sizes['guild blacklist'] = len(self._guild_blacklist)
+        if self.config:
+            sizes['guild configs'] = len(self.config._configs)
+            sizes['config indexes'] = len(self.config._index)
+        if utilities := self.get_cog('Utilities'):
+            sizes['join backlog'] = utilities.joins.depth()
+        return sizes
+
     async def process_direct_messages(self, message):
         if message.guild:
             return
@@ -129,33 +173,70 @@ class Bulbe(RevBot):
                 return True
         return False
 
-    def read_blacklists(self):
+    def _get_blacklist(self, kind):
+        if kind == 'user':
+            return self._user_blacklist
+        elif kind == 'guild':
+            return self._guild_blacklist
+        else:
+            raise ValueError("Argument 'kind' must be either 'user' or 'guild'.")
+
+    async def blacklist(self, kind, snowflake):
+        """Adds a user or guild to the blacklist and persists just that entry."""
+        blacklist = self._get_blacklist(kind)
+        if snowflake in blacklist:
+            return False
+        obj = self.get_user(snowflake) if kind == 'user' else self.get_guild(snowflake)
+        # table first, so a failed write doesn't leave the bot and the table disagreeing
+        await self.table.aput({'name': str(obj)}, [snowflake, BLACKLIST_SORT_KEYS[kind]])
+        blacklist.add(snowflake)
+        return True
+
+    async def unblacklist(self, kind, snowflake):
+        """Removes a user or guild from the blacklist and deletes just that entry."""
+        blacklist = self._get_blacklist(kind)
+        if snowflake not in blacklist:
+            return False
+        await self.table.adelete([snowflake, BLACKLIST_SORT_KEYS[kind]])
+        blacklist.discard(snowflake)
+        return True
+
+    async def read_blacklists(self):
         try:
-            data = self.table.get([0, 'blacklists'])
-            # primary key 0 means general bot data
-            users, guilds = data['users'], data['guilds']
-            self._user_blacklist = [user[0] for user in users]
-            self._guild_blacklist = [guild[0] for guild in guilds]
+            # the sort key index is only eventually consistent, so just-migrated entries are taken from the old item
+            migrated = await self._migrate_blacklists()
+            for kind, sort_key in BLACKLIST_SORT_KEYS.items():
+                if migrated:
+                    snowflakes = migrated[kind]
+                else:
+                    snowflakes = (item[self.table.primary_key] for item in await self.table.aread(sort_key))
+                blacklist = self._get_blacklist(kind)
+                blacklist.clear()
+                blacklist.update(int(snowflake) for snowflake in snowflakes)
             return True
         except Exception as e:
             self.logger.error("Error in read_blacklists.", exc_info=True)
-            self._user_blacklist, self._guild_blacklist = [], []
+            self._user_blacklist, self._guild_blacklist = set(), set()
             return False
 
-    def write_blacklists(self):
-        users = []
-        guilds = []
-        data = dict()
-        for user_id in self._user_blacklist:
-            users.append([user_id, str(self.get_user(user_id))])
-        for guild_id in self._guild_blacklist:
-            guilds.append([guild_id, str(self.get_guild(guild_id))])
-        data['users'], data['guilds'] = users, guilds
+    async def _migrate_blacklists(self):
+        """
+        Splits the old single [0, 'blacklists'] item into one item per entry.
+        Returns the migrated ids as {kind: [ids]}, or None if there was nothing to migrate.
+        """
         try:
-            self.table.put(data, [0, 'blacklists'])
-            return True
-        except Exception:
-            return False
+            data = await self.table.aget([0, 'blacklists'])
+        except KeyError:
+            return None
+        self.logger.info("Migrating blacklists to per-entry items.")
+        migrated = dict()
+        for kind, entries in (('user', data['users']), ('guild', data['guilds'])):
+            items = [{self.table.primary_key: snowflake, 'name': name} for snowflake, name in entries]
+            if items:
+                await self.table.awrite(items, BLACKLIST_SORT_KEYS[kind])
+            migrated[kind] = [snowflake for snowflake, name in entries]
+        await self.table.adelete([0, 'blacklists'])
+        return migrated
 
     async def setup(self):
         self.logger.info('Loading YAML data.')
@@ -164,19 +245,21 @@ class Bulbe(RevBot):
             self.logger.error('Error reading properties file. Shutting down.')
             await self.close(-1)
         self.logger.info("Setting up DynamoDB table.")
+        self.mark_phase('table')
         try:
             self.table = Table(self._name.capitalize())
         except:
             self.logger.error("Error setting up table. Shutting down.")
             await self.close(-1)
-        self.logger.info('Loading cogs.')
-        for cog in self.properties.cogs:
+        if self._config_cache_path:
+            self.logger.info("Connecting to shared config cache.")
             try:
-                self.load_extension(cog)
-                self.logger.info(f"-> Loaded {cog}.")
-            except Exception as e:
-                self.logger.error(f"-> Failed to load extension {cog}.", exc_info=True)
-        b = self.read_blacklists()
+                self.config_cache = await ConfigCacheClient.connect(self._config_cache_path, self.logger)
+            except OSError:
+                self.logger.error("Error connecting to config cache. Continuing without it.", exc_info=True)
+        self.logger.info('Loading cogs and blacklists.')
+        self.mark_phase('cogs')
+        _, b = await asyncio.gather(self.load_extensions(self.properties.cogs), self.read_blacklists())
         if not b:
             self.logger.error("Error reading blacklists. Continuing without blacklists")
 
@@ -188,5 +271,16 @@ class Bulbe(RevBot):
             except AttributeError:
                 pass
         self.logger.info("Dumping data.")
-        self.write_blacklists()
+        if self.config:
+            c = await self.config.flush()
+            if not c:
+                self.logger.error("Error flushing config. Retrying with blocking write.")
+                self.config.write()
+        if stats := self.get_cog('Stats'):
+            await stats.flush()
+        if self.config_cache:
+            await self.config_cache.close()
+        # None if setup failed before the table was created
+        if self.table:
+            self.table.close()
 
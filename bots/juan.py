@@ -1,6 +1,6 @@
 
 import discord
-from discord.ext import tasks, commands
+from discord.ext import tasks
 
 import yaml
 import os
@@ -40,17 +40,15 @@ class Juandissimo(RevBot):
         if not p:
             self.logger.error("Error reading properties. Exiting.")
             await self.close()
+        self.mark_phase('table')
         self.table = Table(self.properties.table)
         self.logger.info("Loading cogs.")
-        for cog in self.properties.cogs:
-            try:
-                self.load_extension(cog)
-                self.logger.info(f"Loaded cog {cog}.")
-            except commands.ExtensionError:
-                self.logger.error(f"Error loading cog {cog}:", exc_info=True)
+        self.mark_phase('cogs')
+        await self.load_extensions(self.properties.cogs)
         self.logger.info("Done setting up.")
 
     async def read_properties(self):
+        self.mark_phase('reading properties')
         try:
             if (filename := f"juan.yaml") in os.listdir(utility.HOME_DIR + "/configs"):
                 with open(utility.HOME_DIR + "/configs/" + filename) as f:
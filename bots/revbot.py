@@ -5,6 +5,7 @@ from discord.ext import commands, tasks
 import signal
 import asyncio
 import datetime
+import time
 import yaml
 import os
 import sys
@@ -14,29 +15,133 @@ import sdnotify
 # custom imports
 from utils import utility
 from utils.utility import setup_logger
+from utils.profiler import LoopProfiler
+from utils.metrics import MetricsServer
 
 VERSION = "1.0.4"
 
+# systemd restarts the bot if it goes WatchdogSec (30s) without a WATCHDOG=1 ping
+WATCHDOG_INTERVAL = 5
+# pings are withheld while the event loop falls this many seconds behind schedule
+LOOP_LAG_THRESHOLD = 5
+# or while every shard's gateway heartbeat latency is above this (or unknown)
+HEARTBEAT_LATENCY_THRESHOLD = 10
+
 
 class RevBot(commands.AutoShardedBot):
     """
     Base class for bots intended to be run as systemd services.
     """
-    def __init__(self, name, command_prefix=None, logger=None, **kwargs):
+    def __init__(self, name, command_prefix=None, logger=None, notifier=None, profile=False, metrics_port=None, **kwargs):
         self._default_prefix = '__'
         command_prefix = command_prefix if command_prefix else self._default_prefix
         super().__init__(command_prefix, **kwargs)
-        self._sd_notifier = sdnotify.SystemdNotifier() if sys.platform == 'linux' else None
+        # notifier can be anything with a notify(str) method, e.g. a launcher.WorkerNotifier when run as a shard worker
+        if notifier:
+            self._sd_notifier = notifier
+        else:
+            self._sd_notifier = sdnotify.SystemdNotifier() if sys.platform == 'linux' else None
         self._revbot_version = VERSION
         self._name = name
         self.properties = None
         self._exit_code = 0
         self.logger = logger if logger else setup_logger(name)
         self.started_at = datetime.datetime.now()
+        # startup phases as (name, time.monotonic()) pairs
+        self.timeline = list()
+        self._startup_complete = False
+        self.loop_lag = 0.0
+        self._last_watchdog = None
+        # LoopProfiler while profiling (launcher.py --profile, or the admin profiler command), otherwise None
+        self.profiler = None
+        self._profile_on_start = profile
+        # localhost port for the metrics endpoint (launcher.py --metrics-port, or 'metrics port' in the bot's yaml)
+        self._metrics_port = metrics_port
+        self.metrics_server = None
+        self.mark_phase('init')
+        self.add_listener(self._timeline_connect, 'on_connect')
+        self.add_listener(self._timeline_ready, 'on_ready')
+        # no WATCHDOG=1 until READY=1: a ping now would start the 30s watchdog timer during a startup that can take minutes
         self.logger.debug(f"RevBot initialization complete. [{VERSION}]")
+
+    def mark_phase(self, phase, timestamp=None):
+        """Records a startup phase on the timeline."""
+        self.timeline.append((phase, timestamp if timestamp is not None else time.monotonic()))
+
+    def format_timeline(self):
+        """Returns one line per phase: time since the first phase, and time since the previous one."""
+        timeline = sorted(self.timeline, key=lambda phase: phase[1])
+        if not timeline:
+            return []
+        first = previous = timeline[0][1]
+        lines = []
+        for phase, timestamp in timeline:
+            lines.append(f"{phase}: +{timestamp - first:.2f}s ({timestamp - previous:.2f}s)")
+            previous = timestamp
+        return lines
+
+    async def _timeline_connect(self):
+        if not self._startup_complete:
+            self.mark_phase('connected')
+
+    async def _timeline_ready(self):
+        # on_ready fires again after reconnects, only the first one ends startup
+        if self._startup_complete:
+            return
+        self._startup_complete = True
+        self.mark_phase('ready')
+        self.logger.info("Startup timeline: " + ", ".join(self.format_timeline()))
         if self._sd_notifier:
             self.sd_notify('READY=1')
-            self.sd_notify('WATCHDOG=1')
+            self.watchdog.start()
+
+    def start_profiler(self):
+        """Starts profiling blocking calls on the event loop. Slows the bot down, so it's off by default."""
+        if not self.profiler:
+            self.profiler = LoopProfiler(self)
+            self.profiler.start()
+            self.logger.info("Event loop profiler started.")
+        return self.profiler
+
+    def stop_profiler(self):
+        if self.profiler:
+            self.profiler.stop()
+            self.logger.info("Event loop profiler stopped:\n" + "\n".join(self.profiler.report()))
+            self.profiler = None
+
+    def cache_sizes(self):
+        """Sizes of the bot's in-memory caches, for the metrics endpoint. Subclasses can add their own."""
+        return {
+            'guilds': len(self.guilds),
+            'users': len(self.users),
+            'messages': len(self.cached_messages),
+        }
+
+    async def start_metrics_server(self):
+        port = self._metrics_port or getattr(self.properties, 'metrics_port', None)
+        if not port:
+            return
+        self.metrics_server = MetricsServer(self, port)
+        try:
+            await self.metrics_server.start()
+        except OSError:
+            self.logger.error(f"Error starting metrics server on port {port}. Continuing without it.", exc_info=True)
+            self.metrics_server = None
+
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        task = super()._schedule_event(coro, event_name, *args, **kwargs)
+        if self.profiler:
+            # the profiler reports slow callbacks by task name
+            task.set_name(f"event {event_name} {getattr(coro, '__qualname__', coro)}")
+        return task
+
+    async def invoke(self, ctx):
+        # for command latency stats
+        ctx.invoked_at = time.perf_counter()
+        if self.profiler and ctx.command:
+            # not restored afterwards, so a command that blocks right before returning is still reported by name
+            asyncio.current_task().set_name(f"command {ctx.command.qualified_name}")
+        await super().invoke(ctx)
 
     async def try_run(self, coro):
         try:
@@ -50,8 +155,6 @@ class RevBot(commands.AutoShardedBot):
         Override this to override discord.Client on_ready.
         """
         self.logger.info('Logged in as {0.user}.'.format(self))
-        if self._sd_notifier:
-            self.watchdog.start()
 
     async def ping_response(self, channel):
         await channel.send(embed=discord.Embed(title=f"{self._name} ({datetime.datetime.now() - self.started_at})",
@@ -73,9 +176,31 @@ class RevBot(commands.AutoShardedBot):
                               f"author {ctx.author.id}, guild {ctx.guild.id if ctx.guild else None}, channel {ctx.channel.id}, message {ctx.message.id}\n"
                               f"{traceback.format_exception(type(exception), exception, exception.__traceback__)}")
 
-    @tasks.loop(seconds=5)
+    @tasks.loop(seconds=WATCHDOG_INTERVAL)
     async def watchdog(self):
-        self.sd_notify("WATCHDOG=1")
+        now = time.monotonic()
+        if self._last_watchdog is not None:
+            # how much later than scheduled this ran, i.e. how long the loop was blocked
+            self.loop_lag = max(0.0, now - self._last_watchdog - WATCHDOG_INTERVAL)
+        self._last_watchdog = now
+        healthy, status = self.health_check()
+        self.sd_notify(f"STATUS={status}")
+        if healthy:
+            self.sd_notify("WATCHDOG=1")
+        else:
+            self.logger.warning(f"Withholding watchdog ping: {status}")
+
+    def health_check(self):
+        """Returns (healthy, status text) based on event loop lag and per-shard gateway latency."""
+        latencies = dict(self.latencies)
+        # `not latency < threshold` so inf/nan (no heartbeat acknowledged yet) count as unhealthy
+        unhealthy_shards = [shard_id for shard_id, latency in latencies.items() if not latency < HEARTBEAT_LATENCY_THRESHOLD]
+        heartbeats = ", ".join(f"shard {shard_id} {latency * 1000:.0f}ms" for shard_id, latency in sorted(latencies.items()))
+        if self.loop_lag > LOOP_LAG_THRESHOLD:
+            return False, f"Event loop stalled: {self.loop_lag:.2f}s behind. Heartbeats: {heartbeats}"
+        if latencies and len(unhealthy_shards) == len(latencies):
+            return False, f"No healthy gateway connection. Heartbeats: {heartbeats}"
+        return True, f"Loop lag {self.loop_lag:.2f}s. Heartbeats: {heartbeats}"
 
     def sd_notify(self, arg):
         self._sd_notifier.notify(arg)
@@ -88,6 +213,83 @@ class RevBot(commands.AutoShardedBot):
         """
         pass
 
+    async def load_extensions(self, extensions):
+        """
+        Loads extensions, then sets up their cogs with setup_extensions.
+        Returns {extension: load time in seconds} for every extension that loaded successfully.
+        """
+        timings = dict()
+        for extension in extensions:
+            started = time.perf_counter()
+            try:
+                self.load_extension(extension)
+            except Exception:
+                self.logger.error(f"-> Failed to load extension {extension}.", exc_info=True)
+                continue
+            timings[extension] = time.perf_counter() - started
+        return await self.setup_extensions(list(timings), timings)
+
+    def extension_cogs(self, extension):
+        """Names of the loaded cogs defined by an extension."""
+        return [name for name, cog in self.cogs.items()
+                if cog.__module__ == extension or cog.__module__.startswith(extension + '.')]
+
+    async def setup_extensions(self, extensions, timings=None):
+        """
+        Runs the async setup of already loaded extensions' cogs concurrently.
+
+        Cogs can define an async cog_setup() method for slow initialization (database reads, etc.),
+        and a `dependencies` tuple of cog names whose cog_setup must finish before theirs starts.
+        Extensions whose cogs fail to set up are unloaded. Returns {extension: load time in seconds}.
+        """
+        timings = timings if timings is not None else {extension: 0.0 for extension in extensions}
+        cogs = {name: extension for extension in extensions for name in self.extension_cogs(extension)}
+        finished = {name: asyncio.Event() for name in cogs}
+        failed = set()
+
+        def dependencies(name):
+            return getattr(self.cogs[name], 'dependencies', ())
+
+        async def setup_cog(name):
+            cog = self.cogs[name]
+            try:
+                for dependency in dependencies(name):
+                    if dependency in finished:
+                        await finished[dependency].wait()
+                    if dependency in failed or dependency not in self.cogs:
+                        raise commands.ExtensionError(f"Cog {name} depends on {dependency}, which isn't loaded or failed to set up.", name=name)
+                started = time.perf_counter()
+                if hasattr(cog, 'cog_setup'):
+                    await cog.cog_setup()
+                timings[cogs[name]] += time.perf_counter() - started
+            except Exception:
+                self.logger.error(f"-> Failed to set up cog {name}.", exc_info=True)
+                failed.add(name)
+            finally:
+                finished[name].set()
+
+        # cogs in a dependency cycle would wait on each other forever
+        resolved = set()
+        while True:
+            ready = {name for name in cogs if name not in resolved
+                     and all(d in resolved or d not in cogs for d in dependencies(name))}
+            if not ready:
+                break
+            resolved |= ready
+        for name in set(cogs) - resolved:
+            self.logger.error(f"-> Cog {name} is in or depends on a dependency cycle.")
+            failed.add(name)
+            finished[name].set()
+
+        await asyncio.gather(*(setup_cog(name) for name in resolved))
+
+        for extension in {cogs[name] for name in failed}:
+            self.unload_extension(extension)
+            timings.pop(extension, None)
+        for extension, seconds in timings.items():
+            self.logger.info(f"-> Loaded {extension} ({seconds:.2f}s).")
+        return timings
+
     async def cleanup(self):
         """
         Called when bot is closed, before logging out.
@@ -96,6 +298,7 @@ class RevBot(commands.AutoShardedBot):
         pass
 
     async def read_properties(self):
+        self.mark_phase('reading properties')
         try:
             if (filename := f"{self._name}.yaml") in os.listdir(f"{utility.HOME_DIR}/configs"):
                 with open(f"{utility.HOME_DIR}/configs/" + filename) as f:
@@ -121,15 +324,28 @@ class RevBot(commands.AutoShardedBot):
             pass
         # self.watchdog.start()
         # self.logger.info("Watchdog loop started.")
+        if self._profile_on_start:
+            self.start_profiler()
         self.logger.info("Setting up.")
+        self.mark_phase('setup')
         await self.setup()
+        self.mark_phase('setup complete')
+        await self.start_metrics_server()
         self.logger.debug("Setup complete.")
         self.logger.debug("Calling super().start method.")
         await super().start(*args, **kwargs)
 
+    async def login(self, *args, **kwargs):
+        self.mark_phase('login')
+        await super().login(*args, **kwargs)
+        self.mark_phase('logged in')
+
     async def close(self, exit_code=0):
         self.logger.debug("RevBot: Received command to shut down. Beginning safe shutdown sequence.")
         self._exit_code = exit_code
+        self.stop_profiler()
+        if self.metrics_server:
+            await self.metrics_server.stop()
         await self.cleanup()
         self.logger.debug("Closing connection to discord.")
         await super().close()
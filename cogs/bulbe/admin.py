@@ -14,6 +14,7 @@ from discord.ext import commands
 from utils import checks
 from utils import paginator
 from utils import converters
+from utils.utility import logging_stats
 
 
 class Admin(commands.Cog):
@@ -108,12 +109,10 @@ class Admin(commands.Cog):
     @commands.command()
     async def load(self, ctx, *, cog):
         """Loads a cog."""
-        try:
-            self.bot.load_extension(cog)
-        except commands.ExtensionError as e:
-            await ctx.send(f'{e.__class__.__name__}: {e}')
-        else:
+        if cog in await self.bot.load_extensions([cog]):
             await ctx.send(f'Loaded {cog}.')
+        else:
+            await ctx.send(f'Failed to load {cog}. Check the logs for details.')
 
     @commands.command()
     async def unload(self, ctx, *, cog):
@@ -132,8 +131,59 @@ class Admin(commands.Cog):
             self.bot.reload_extension(cog)
         except commands.ExtensionError as e:
             await ctx.send(f'{e.__class__.__name__}: {e}')
-        else:
+            return
+        if cog in await self.bot.setup_extensions([cog]):
             await ctx.send(f'Reloaded {cog}.')
+        else:
+            await ctx.send(f'Failed to set up {cog}. Check the logs for details.')
+
+    @commands.command()
+    async def logstats(self, ctx):
+        """Shows logger, handler and file descriptor counts."""
+        stats = logging_stats()
+        await ctx.send("```\n" + "\n".join(f"{key}: {value}" for key, value in stats.items()) + "\n```")
+
+    @commands.command()
+    async def dbstats(self, ctx, hot_keys: int = 5):
+        """Shows DynamoDB latency, consumed capacity, throttles and the hottest keys."""
+        def ms(seconds):
+            return f"{seconds * 1000:.0f}ms" if seconds is not None else "-"
+        table = self.bot.table
+        lines = [f"{'operation':<17} {'calls':>6} {'p50':>6} {'p95':>6} {'p99':>6} {'capacity':>9} {'thr':>4} {'retry':>5} {'err':>4}"]
+        for operation, s in sorted(table.stats().items()):
+            lines.append(f"{operation:<17} {s['calls']:>6} {ms(s['p50']):>6} {ms(s['p95']):>6} {ms(s['p99']):>6} "
+                         f"{s['capacity']:>9.1f} {s['throttles']:>4} {s['retries']:>5} {s['errors']:>4}")
+        if hot_keys:
+            lines.append("\nHottest keys (capacity units):")
+            lines.extend(f"{units:>9.1f}  {key}" for key, units in table.hottest_keys(hot_keys))
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
+    @commands.command()
+    async def timeline(self, ctx):
+        """Shows how long each startup phase took."""
+        await ctx.send("```\n" + "\n".join(self.bot.format_timeline()) + "\n```")
+
+    @commands.group(invoke_without_command=True)
+    async def profiler(self, ctx, top: int = 10):
+        """Shows what has blocked the event loop the most since the profiler started."""
+        if not self.bot.profiler:
+            return await ctx.send(f"The profiler isn't running. Start it with `{ctx.prefix}profiler start`.")
+        await ctx.send("```\n" + "\n".join(self.bot.profiler.report(top)) + "\n```")
+
+    @profiler.command(name='start')
+    async def profiler_start(self, ctx):
+        """Starts the event loop profiler."""
+        self.bot.start_profiler()
+        await ctx.send("Profiler started.")
+
+    @profiler.command(name='stop')
+    async def profiler_stop(self, ctx):
+        """Stops the event loop profiler and shows its report."""
+        if not self.bot.profiler:
+            return await ctx.send("The profiler isn't running.")
+        report = self.bot.profiler.report()
+        self.bot.stop_profiler()
+        await ctx.send("```\n" + "\n".join(report) + "\n```")
 
     @commands.command()
     async def sudo(self, ctx, channel: typing.Optional[converters.GlobalChannel], who: discord.User, *, command: str):
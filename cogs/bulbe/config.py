@@ -3,15 +3,24 @@ import discord
 from discord import Member, TextChannel, Role
 from discord.ext import commands, tasks
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from collections.abc import Mapping
+from types import MappingProxyType
 from typing import Union, Optional
 import traceback
+import asyncio
+import copy
 
 from utils import checks
 from utils.db import Table
 from utils.utility import module_logger, green_tick, red_tick
 from utils.converters import Module, Command
 
+# seconds between write-behind flushes of edited guild configs
+FLUSH_INTERVAL = 30
+# flush early if this many guilds are waiting to be written
+FLUSH_THRESHOLD = 25
+
 DEFAULT_CONFIG = {
     # meta
     'prefix': None,
@@ -61,137 +70,309 @@ DEFAULT_CONFIG = {
 }
 
 
+def freeze(value):
+    """Returns a read-only copy of a config value (dicts become mapping proxies, lists become tuples)."""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+class ConfigView(Mapping):
+    """Read-only config. Like a guild's own config, missing keys read as None."""
+    def __init__(self, data):
+        self._data = freeze(data)
+
+    def __getitem__(self, key):
+        return self._data.get(key)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+
+# shared by every guild that hasn't changed its config
+DEFAULT_VIEW = ConfigView(DEFAULT_CONFIG)
+
+
+# compiled, read-only view of the parts of a guild config that global_checks looks at
+GuildIndex = namedtuple('GuildIndex', ['ignored_channels', 'ignored_users', 'ignored_roles',
+                                       'disabled_modules', 'disabled_commands', 'roles'])
+
+
+def _ids(section, key):
+    try:
+        return frozenset(section[key] or ())
+    except (KeyError, TypeError):
+        return frozenset()
+
+
+def build_index(config):
+    ignored = config['ignored'] if isinstance(config['ignored'], Mapping) else None
+    disabled = config['disabled'] if isinstance(config['disabled'], Mapping) else None
+    roles = config['roles'] if isinstance(config['roles'], Mapping) else dict()
+    return GuildIndex(
+        ignored_channels=_ids(ignored, 'channels'),
+        ignored_users=_ids(ignored, 'users'),
+        ignored_roles=_ids(ignored, 'roles'),
+        disabled_modules=_ids(disabled, 'modules'),
+        disabled_commands=_ids(disabled, 'commands'),
+        roles={permission: _ids(roles, permission) for permission, value in roles.items() if isinstance(value, (list, tuple))},
+    )
+
+
 class ConfigManager:
+    """
+    Holds the configs of every guild on this process's shards in memory.
+
+    Configs are copy-on-write: guilds that were never configured share the
+    read-only DEFAULT_VIEW, and only get their own config from edit_config.
+
+    Edits are write-behind: write_guild only marks the guild as dirty, and
+    dirty guilds are written together in one batch by flush(), which runs on
+    a timer, when too many guilds are waiting, and on shutdown.
+    """
     def __init__(self, bot, cog):
         self.bot = bot
         self.table = bot.table
-        self._configs = defaultdict(self.empty)
+        self._configs = dict()
+        self._dirty = set()
+        # flushes run one at a time, or an older snapshot could be written after a newer one
+        self._flush_lock = asyncio.Lock()
+        self._index = dict()
+        self._empty_index = build_index(DEFAULT_VIEW)
         self.logger = cog.logger
 
     @staticmethod
     def empty():
         config = defaultdict(lambda: None)
-        config.update(DEFAULT_CONFIG)
+        config.update(copy.deepcopy(DEFAULT_CONFIG))
         return config
 
-    def read(self):
+    def owns(self, guild_id):
+        """Whether the guild is on one of this process's shards. Always true when not sharded."""
+        shard_ids = getattr(self.bot, 'shard_ids', None)
+        shard_count = getattr(self.bot, 'shard_count', None)
+        if not shard_ids or not shard_count:
+            return True
+        return (guild_id >> 22) % shard_count in shard_ids
+
+    async def read(self):
         try:
-            data = self.table.read_to_dict('config')
+            data = await self.table.aread_to_dict('config')
             for guild_id, guild_config in data.items():
-                self.get_config(guild_id).update(guild_config)
+                if self.owns(guild_id):
+                    self.edit_config(guild_id).update(guild_config)
+            self._index.clear()
             return True
         except Exception as e:
             print(str(e))
             return False
 
-    def write(self):
+    async def read_from_cache(self, cache):
+        """
+        Loads this process's guilds' configs from the host's shared config cache (multi-process mode)
+        and subscribes to edits made by other workers. Falls back to reading the table.
+        """
+        # subscribed before asking for configs, so edits sent meanwhile aren't lost. they're newer than the dump
+        updated = set()
+
+        def apply_early_update(guild_id, guild_config):
+            updated.add(guild_id)
+            self.apply_update(guild_id, guild_config)
+
+        cache.callback = apply_early_update
         try:
-            self.update_names()
-            self.table.write_from_dict(self._configs, 'config')
-            return True
+            data = await cache.get_all()
         except Exception:
-            traceback.print_exc()
-            return False
+            self.logger.error("Error loading configs from cache. Reading table instead.", exc_info=True)
+            data = await self.table.aread_to_dict('config')
+        loaded = 0
+        for guild_id, guild_config in data.items():
+            if guild_id not in updated and self.owns(guild_id):
+                self.edit_config(guild_id).update(guild_config)
+                loaded += 1
+        self._index.clear()
+        self.bot.invalidate_prefix()
+        cache.callback = self.apply_update
+        self.logger.info(f"Loaded {loaded} of {len(data)} configs from cache.")
+
+    def apply_update(self, guild_id, guild_config):
+        """Replaces a guild's config with one edited by another worker."""
+        if not self.owns(guild_id):
+            return
+        config = self.empty()
+        config.update(guild_config)
+        self._configs[guild_id] = config
+        self.invalidate(guild_id)
+        self.bot.invalidate_prefix(guild_id)
+
+    def _pop_dirty(self):
+        """Takes a snapshot of every dirty config and clears the dirty set."""
+        dirty, self._dirty = self._dirty, set()
+        items = list()
+        for guild_id in dirty:
+            item = copy.deepcopy(dict(self.get_config(guild_id)))
+            item[self.table.primary_key] = guild_id
+            items.append(item)
+        return dirty, items
 
-    def write_guild(self, guild):
+    def write(self):
+        """Blocking flush, for when the event loop can't be used (cog unload)."""
+        dirty, items = self._pop_dirty()
+        if not items:
+            return True
         try:
-            self.update_name(guild.id)
-            self.table.put(self.get_config(guild), [guild.id, 'config'])
+            self.table.write(items, 'config')
             return True
         except Exception:
+            self._dirty |= dirty
+            traceback.print_exc()
             return False
 
+    async def flush(self):
+        """Writes every dirty guild config to the table in one batch."""
+        async with self._flush_lock:
+            dirty, items = self._pop_dirty()
+            if not items:
+                return True
+            try:
+                await self.table.awrite(items, 'config')
+                self.logger.debug(f"Flushed {len(items)} guild configs.")
+                return True
+            except Exception:
+                self._dirty |= dirty
+                self.logger.error(f"Error flushing {len(items)} guild configs.", exc_info=True)
+                return False
+
+    async def write_guild(self, guild):
+        guild_id = guild if isinstance(guild, int) else guild.id
+        self.update_name(guild_id)
+        self._dirty.add(guild_id)
+        if self.bot.config_cache:
+            try:
+                await self.bot.config_cache.publish(guild_id, dict(self.get_config(guild_id)))
+            except Exception:
+                self.logger.error(f"Error publishing config for guild {guild_id} to cache.", exc_info=True)
+        if len(self._dirty) >= FLUSH_THRESHOLD:
+            return await self.flush()
+        return True
+
     def update_names(self):
         for guild_id in self.guilds():
             self.update_name(guild_id)
 
     def update_name(self, guild_id):
+        config = self._configs.get(guild_id)
         guild = self.bot.get_guild(guild_id)
-        if guild:
-            self.get_config(guild)['name'] = guild.name
+        if config is not None and guild:
+            if config['name'] != guild.name:
+                config['name'] = guild.name
+                self._dirty.add(guild_id)
 
-    def get_config(self, guild):
+    @staticmethod
+    def _guild_id(guild):
         if isinstance(guild, int):
-            return self._configs[guild]
+            return guild
         elif isinstance(guild, discord.Guild):
-            return self._configs[guild.id]
+            return guild.id
         else:
             raise TypeError("Argument 'guild' must be either a Guild or an integer.")
 
-    def set_config(self, guild, new_config):
-        self.get_config(guild).update(new_config)
-        self.write_guild(guild)
+    def get_config(self, guild):
+        """Returns a guild's config for reading. Unconfigured guilds get the shared, read-only DEFAULT_VIEW."""
+        return self._configs.get(self._guild_id(guild), DEFAULT_VIEW)
+
+    def edit_config(self, guild):
+        """Returns a guild's own, mutable config, copying it from the defaults if it doesn't have one yet."""
+        guild_id = self._guild_id(guild)
+        try:
+            return self._configs[guild_id]
+        except KeyError:
+            config = self._configs[guild_id] = self.empty()
+            return config
+
+    def has_config(self, guild):
+        return self._guild_id(guild) in self._configs
+
+    async def set_config(self, guild, new_config):
+        self.edit_config(guild).update(new_config)
+        self.invalidate(guild)
+        await self.write_guild(guild)
 
     def reset_config(self, guild):
-        if isinstance(guild, int):
-            del self._configs[guild]
-        elif isinstance(guild, discord.Guild):
-            del self._configs[guild.id]
-        else:
-            raise TypeError("Argument 'guild' must be either a Guild or an integer.")
+        self._configs.pop(self._guild_id(guild), None)
+        self.invalidate(guild)
+
+    def get_index(self, guild):
+        """Returns the compiled GuildIndex for a guild, building it if needed."""
+        guild_id = guild if isinstance(guild, int) else guild.id
+        try:
+            return self._index[guild_id]
+        except KeyError:
+            pass
+        if guild_id not in self._configs:
+            return self._empty_index
+        index = self._index[guild_id] = build_index(self._configs[guild_id])
+        return index
+
+    def invalidate(self, guild):
+        """Drops a guild's compiled index. Must be called after editing its config."""
+        guild_id = guild if isinstance(guild, int) else guild.id
+        self._index.pop(guild_id, None)
 
     # def get_section(self, guild, section_name):
     #     return self.get_config(guild)[section_name]
 
-    def edit_section(self, guild, section_name, new_data):
-        section = self.get_config(guild)[section_name]
+    async def edit_section(self, guild, section_name, new_data):
+        config = self.edit_config(guild)
+        section = config[section_name]
         if isinstance(section, dict):
             section.update(new_data)
         else:
-            self.get_config(guild)[section_name] = new_data
-        self.write_guild(guild)
+            config[section_name] = new_data
+        self.invalidate(guild)
+        await self.write_guild(guild)
 
     def guilds(self):
         return list(self._configs.keys())
 
     def command_disabled(self, ctx):
         """Returns True if the command has been disabled."""
-        disabled = self.get_config(ctx.guild)['disabled']
-        if disabled is None or not isinstance(disabled, dict):
-            return False
-        try:
-            if ctx.cog.qualified_name in disabled['modules']:
-                return True
-        except KeyError:
-            pass
-        except AttributeError:
-            pass
-        try:
-            if ctx.command.qualified_name in disabled['commands']:
-                return True
-        except KeyError:
-            pass
-        except AttributeError:
-            pass
+        index = self.get_index(ctx.guild)
+        if ctx.cog is not None and ctx.cog.qualified_name in index.disabled_modules:
+            return True
+        if ctx.command is not None and ctx.command.qualified_name in index.disabled_commands:
+            return True
         return False
 
     def is_ignored(self, ctx):
         """Returns True if the channel, user, or one of the user's roles should be ignored."""
-        ignored = self.get_config(ctx.guild)['ignored']
-        if ignored is None or not isinstance(ignored, dict):
-            return False
-        try:
-            if ctx.channel.id in ignored['channels']:
-                return True
-        except KeyError:
-            pass
-        except AttributeError:
-            pass
-        try:
-            if ctx.author.id in ignored['users']:
-                return True
-        except KeyError:
-            pass
-        except AttributeError:
-            pass
-        try:
-            for role in ctx.author.roles:
-                if role.id in ignored['roles']:
-                    return True
-        except KeyError:
-            pass
-        except AttributeError:
-            pass
+        index = self.get_index(ctx.guild)
+        if ctx.channel.id in index.ignored_channels or ctx.author.id in index.ignored_users:
+            return True
+        if index.ignored_roles:
+            return not index.ignored_roles.isdisjoint(role.id for role in getattr(ctx.author, 'roles', ()))
+        return False
+
+    def has_permission(self, ctx, permission):
+        """
+        Returns True if the author or one of their roles is configured for this permission.
+        Returns None if the permission doesn't exist.
+        """
+        ids = self.get_index(ctx.guild).roles.get(permission)
+        if ids is None:
+            return None
+        if ctx.author.id in ids:
+            return True
+        if ids:
+            return not ids.isdisjoint(role.id for role in getattr(ctx.author, 'roles', ()))
         return False
 
 
@@ -203,15 +384,29 @@ class Config(commands.Cog):
             raise Exception("Connection to DynamoDB table not found.")
         self.bot.config = ConfigManager(bot, self)
         self.config = self.bot.config
-        c = self.config.read()
-        if not c:
-            raise Exception("Config could not be loaded from DynamoDB.")
+        self.flush_configs.start()
+
+    async def cog_setup(self):
+        if self.bot.config_cache:
+            await self.config.read_from_cache(self.bot.config_cache)
+        else:
+            c = await self.config.read()
+            if not c:
+                raise Exception("Config could not be loaded from DynamoDB.")
+            self.bot.invalidate_prefix()
 
     def cog_unload(self):
+        self.flush_configs.cancel()
+        if self.bot.config_cache:
+            self.bot.config_cache.callback = None
         c = self.config.write()
         if not c:
             self.logger.error("Error writing config to database.")
 
+    @tasks.loop(seconds=FLUSH_INTERVAL)
+    async def flush_configs(self):
+        await self.config.flush()
+
     @commands.Cog.listener()
     async def on_ready(self):
         # self.logger.info("Generating empty configs for non-configured guilds")
@@ -230,10 +425,11 @@ class Config(commands.Cog):
         if ctx.invoked_subcommand is None:
             s = "**Current Config:**```\n"
             config = False
-            for key, value in self.config.get_config(ctx.guild).items():
-                if key not in ('name', 'guildID', 'dataType') and value != DEFAULT_CONFIG[key]:
-                    config = True
-                    s += f"{key}: {value}\n"
+            if self.config.has_config(ctx.guild):
+                for key, value in self.config.get_config(ctx.guild).items():
+                    if key not in ('name', 'guildID', 'dataType') and value != DEFAULT_CONFIG[key]:
+                        config = True
+                        s += f"{key}: {value}\n"
             s += "```"
             if config:
                 await ctx.send(s)
@@ -254,25 +450,25 @@ class Config(commands.Cog):
             await ctx.send(f"{red_tick} Prefix can only be up to 5 characters!")
             return
         # config['prefix'] = new_prefix
-        self.config.edit_section(ctx.guild.id, 'prefix', new_prefix)
+        await self.config.edit_section(ctx.guild.id, 'prefix', new_prefix)
+        self.bot.invalidate_prefix(ctx.guild.id)
         await ctx.send(f"{green_tick} Prefix set to `{new_prefix}`")
 
     @configure_bot.command()
     @checks.edit_config()
     async def ignore(self, ctx, target: Union[TextChannel, Member, Role]):
         """Sets bot to ignore commands by certain users, users with certain roles, or in a certain channel."""
-        config = self.config.get_config(ctx.guild)
+        config = self.config.edit_config(ctx.guild)
         ignored = config['ignored']
         if ignored is None:
-            ignored = dict()
-            ignored.update(DEFAULT_CONFIG['ignored'])
+            ignored = copy.deepcopy(DEFAULT_CONFIG['ignored'])
 
         if isinstance(target, TextChannel):
             if target.id in ignored['channels']:
                 await ctx.send(f"{red_tick} Channel `{target.name}` is already in ignore list!")
                 return
             ignored['channels'].append(target.id)
-            self.config.edit_section(ctx.guild, 'ignored', ignored)
+            await self.config.edit_section(ctx.guild, 'ignored', ignored)
             await ctx.send(f"{green_tick} I will ignore channel `{target.name}` in this guild.")
             return
 
@@ -281,7 +477,7 @@ class Config(commands.Cog):
                 await ctx.send(f"{red_tick} User `{target.name}` is already in ignore list!")
                 return
             ignored['users'].append(target.id)
-            self.config.edit_section(ctx.guild, 'ignored', ignored)
+            await self.config.edit_section(ctx.guild, 'ignored', ignored)
             await ctx.send(f"{green_tick} I will ignore user `{target.name}` in this guild.")
             return
 
@@ -290,7 +486,7 @@ class Config(commands.Cog):
                 await ctx.send(f"{red_tick} Role `{target.name}` is already in ignore list!")
                 return
             ignored['roles'].append(target.id)
-            self.config.edit_section(ctx.guild, 'ignored', ignored)
+            await self.config.edit_section(ctx.guild, 'ignored', ignored)
             await ctx.send(f"{green_tick} I will ignore role `{target.name}` in this guild.")
             return
 
@@ -298,18 +494,17 @@ class Config(commands.Cog):
     @checks.edit_config()
     async def unignore(self, ctx, target: Union[TextChannel, Member, Role]):
         """Removes a user, role, or channel from this guild's ignored list."""
-        config = self.config.get_config(ctx.guild)
+        config = self.config.edit_config(ctx.guild)
         ignored = config['ignored']
         if ignored is None:
-            ignored = dict()
-            ignored.update(DEFAULT_CONFIG['ignored'])
+            ignored = copy.deepcopy(DEFAULT_CONFIG['ignored'])
 
         if isinstance(target, TextChannel):
             if target.id not in ignored['channels']:
                 await ctx.send(f"{red_tick} Channel `{target.name}` is not in ignore list!")
                 return
             ignored['channels'].remove(target.id)
-            self.config.edit_section(ctx.guild, 'ignored', ignored)
+            await self.config.edit_section(ctx.guild, 'ignored', ignored)
             await ctx.send(f"{green_tick} I will no longer ignore channel `{target.name}` in this guild.")
             return
 
@@ -318,7 +513,7 @@ class Config(commands.Cog):
                 await ctx.send(f"{red_tick} User `{target.name}` is not in ignore list!")
                 return
             ignored['users'].remove(target.id)
-            self.config.edit_section(ctx.guild, 'ignored', ignored)
+            await self.config.edit_section(ctx.guild, 'ignored', ignored)
             await ctx.send(f"{green_tick} I will no longer ignore user `{target.name}` in this guild.")
             return
 
@@ -327,7 +522,7 @@ class Config(commands.Cog):
                 await ctx.send(f"{red_tick} Role `{target.name}` is not in ignore list!")
                 return
             ignored['roles'].remove(target.id)
-            self.config.edit_section(ctx.guild, 'ignored', ignored)
+            await self.config.edit_section(ctx.guild, 'ignored', ignored)
             await ctx.send(f"{green_tick} I will no longer ignore role `{target.name}` in this guild.")
             return
 
@@ -338,18 +533,17 @@ class Config(commands.Cog):
         if target and "config" in target.qualified_name.lower():
             await ctx.send(f"{red_tick} You can't disable the Config module or any of its commands!")
             return
-        config = self.config.get_config(ctx.guild)
+        config = self.config.edit_config(ctx.guild)
         disabled = config['disabled']
         if disabled is None:
-            disabled = dict()
-            disabled.update(DEFAULT_CONFIG['disabled'])
+            disabled = copy.deepcopy(DEFAULT_CONFIG['disabled'])
 
         if isinstance(target, commands.Cog):
             if target.qualified_name in disabled['modules']:
                 await ctx.send(f"{red_tick} Module `{target.qualified_name}` is already disabled!")
                 return
             disabled['modules'].append(target.qualified_name)
-            self.config.edit_section(ctx.guild, 'disabled', disabled)
+            await self.config.edit_section(ctx.guild, 'disabled', disabled)
             await ctx.send(f"{green_tick} Disabled module `{target.qualified_name}` for this guild.")
             return
 
@@ -358,7 +552,7 @@ class Config(commands.Cog):
                 await ctx.send(f"{red_tick} Command `{target.qualified_name}` is already disabled!")
                 return
             disabled['commands'].append(target.qualified_name)
-            self.config.edit_section(ctx.guild, 'disabled', disabled)
+            await self.config.edit_section(ctx.guild, 'disabled', disabled)
             await ctx.send(f"{green_tick} Disabled command `{target.qualified_name}` for this guild.")
             return
 
@@ -366,18 +560,17 @@ class Config(commands.Cog):
     @checks.edit_config()
     async def enable(self, ctx, target: Union[Module, Command]):
         """Enables a disabled command (or every command in a module) in this guild."""
-        config = self.config.get_config(ctx.guild)
+        config = self.config.edit_config(ctx.guild)
         disabled = config['disabled']
         if disabled is None:
-            disabled = dict()
-            disabled.update(DEFAULT_CONFIG['disabled'])
+            disabled = copy.deepcopy(DEFAULT_CONFIG['disabled'])
 
         if isinstance(target, commands.Cog):
             if target.qualified_name not in disabled['modules']:
                 await ctx.send(f"{red_tick} Module `{target.qualified_name}` is not disabled!")
                 return
             disabled['modules'].remove(target.qualified_name)
-            self.config.edit_section(ctx.guild, 'disabled', disabled)
+            await self.config.edit_section(ctx.guild, 'disabled', disabled)
             await ctx.send(f"{green_tick} Enabled module `{target.qualified_name}` for this guild.")
             return
 
@@ -386,7 +579,7 @@ class Config(commands.Cog):
                 await ctx.send(f"{red_tick} Command `{target.qualified_name}` is not disabled!")
                 return
             disabled['commands'].remove(target.qualified_name)
-            self.config.edit_section(ctx.guild, 'disabled', disabled)
+            await self.config.edit_section(ctx.guild, 'disabled', disabled)
             await ctx.send(f"{green_tick} Enabled command `{target.qualified_name}` for this guild.")
             return
 
@@ -404,18 +597,17 @@ class Config(commands.Cog):
         if role.id == ctx.guild.id:
             await ctx.send("Invalid role.")
 
-        config = self.config.get_config(ctx.guild)
+        config = self.config.edit_config(ctx.guild)
         utilities = config['utilities']
         if utilities is None:
-            utilities = dict()
-            utilities.update(DEFAULT_CONFIG['utilities'])
+            utilities = copy.deepcopy(DEFAULT_CONFIG['utilities'])
 
         if role.id in utilities['autorole']:
             await ctx.send(f"{red_tick} Role `{role.name}` is already a configured autorole!")
 
         else:
             utilities['autorole'].append(role.id)
-            self.config.edit_section(ctx.guild, 'utilities', utilities)
+            await self.config.edit_section(ctx.guild, 'utilities', utilities)
             await ctx.send(f"{green_tick} Added `{role.name}` to autoroles.")
 
     @autorole.command(name='remove', aliases=['rm', 'r'])
@@ -425,18 +617,17 @@ class Config(commands.Cog):
         if role.id == ctx.guild.id:
             await ctx.send("Invalid role.")
 
-        config = self.config.get_config(ctx.guild)
+        config = self.config.edit_config(ctx.guild)
         utilities = config['utilities']
         if utilities is None:
-            utilities = dict()
-            utilities.update(DEFAULT_CONFIG['utilities'])
+            utilities = copy.deepcopy(DEFAULT_CONFIG['utilities'])
 
         if role.id not in utilities['autorole']:
             await ctx.send(f"{red_tick} Role `{role.name}` is not a configured autorole!")
 
         else:
             utilities['autorole'].remove(role.id)
-            self.config.edit_section(ctx.guild, 'utilities', utilities)
+            await self.config.edit_section(ctx.guild, 'utilities', utilities)
             await ctx.send(f"{green_tick} Removed `{role.name}` from autoroles.")
 
     @configure_bot.group(aliases=['ps'])
@@ -453,18 +644,17 @@ class Config(commands.Cog):
         if role.id == ctx.guild.id:
             await ctx.send("Invalid role.")
 
-        config = self.config.get_config(ctx.guild)
+        config = self.config.edit_config(ctx.guild)
         utilities = config['utilities']
         if utilities is None:
-            utilities = dict()
-            utilities.update(DEFAULT_CONFIG['utilities'])
+            utilities = copy.deepcopy(DEFAULT_CONFIG['utilities'])
 
         if role.id in utilities['persist']:
             await ctx.send(f"{red_tick} Role `{role.name}` is already a configured persist role!")
 
         else:
             utilities['persist'].append(role.id)
-            self.config.edit_section(ctx.guild, 'utilities', utilities)
+            await self.config.edit_section(ctx.guild, 'utilities', utilities)
             await ctx.send(f"{green_tick} Added `{role.name}` to persist roles.")
 
     @persist.command(name='remove', aliases=['rm', 'r'])
@@ -474,18 +664,17 @@ class Config(commands.Cog):
         if role.id == ctx.guild.id:
             await ctx.send("Invalid role.")
 
-        config = self.config.get_config(ctx.guild)
+        config = self.config.edit_config(ctx.guild)
         utilities = config['utilities']
         if utilities is None:
-            utilities = dict()
-            utilities.update(DEFAULT_CONFIG['utilities'])
+            utilities = copy.deepcopy(DEFAULT_CONFIG['utilities'])
 
         if role.id not in utilities['persist']:
             await ctx.send(f"{red_tick} Role `{role.name}` is not a configured persist role!")
 
         else:
             utilities['persist'].remove(role.id)
-            self.config.edit_section(ctx.guild, 'utilities', utilities)
+            await self.config.edit_section(ctx.guild, 'utilities', utilities)
             await ctx.send(f"{green_tick} Removed `{role.name}` from persist roles.")
 
 
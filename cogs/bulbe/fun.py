@@ -8,9 +8,6 @@ import datetime
 import discord
 from discord.ext import commands
 
-from google.cloud import translate_v2 as translate
-from google.oauth2.service_account import Credentials
-
 from authentication.authentication import cloud_creds, nasa_api_key
 from utils.utility import HOME_DIR, fetch_previous_message, red_tick
 from utils.converters import Language
@@ -19,11 +16,20 @@ from utils.converters import Language
 class Fun(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        credentials = Credentials.from_service_account_file(f"{HOME_DIR}/authentication/{cloud_creds}")
-        self.translator = translate.Client(credentials=credentials)
+        self._translator = None
         self.lang_cache = dict()
         self.session = aiohttp.ClientSession()
 
+    @property
+    def translator(self):
+        """Google Translate client, created on first use so loading this cog doesn't import the Google libraries."""
+        if self._translator is None:
+            from google.cloud import translate_v2 as translate
+            from google.oauth2.service_account import Credentials
+            credentials = Credentials.from_service_account_file(f"{HOME_DIR}/authentication/{cloud_creds}")
+            self._translator = translate.Client(credentials=credentials)
+        return self._translator
+
     @commands.command(name='translate', aliases=['t'])
     async def _translate(self, ctx, lang: typing.Optional[Language] = 'en', *, text: commands.clean_content = None):
         """Translates a message into a language of your choice.
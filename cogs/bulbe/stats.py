@@ -1,22 +1,136 @@
-import discord
-from discord.ext import commands
+import time
+import datetime
+from collections import defaultdict
 
-"""
+from discord.ext import commands, tasks
+
+from utils import checks
+from utils.histogram import Histogram
 
-FIX LOGGING ASAP
+"""
 
 2.2.0 -> implement stats tracking (guild invite tracking and command stats)
 
 """
 
+# minutes between flushes of command stats to the table
+STATS_FLUSH_INTERVAL = 10
+# command stats are stored per day, keyed [yyyymmdd, STATS_SORT_KEY]
+STATS_SORT_KEY = 'commandStats'
+
+
+class CommandStats:
+    """Invocation count, error count and latency histogram for one command."""
+    __slots__ = ('uses', 'errors', 'latency')
+
+    def __init__(self):
+        self.uses = 0
+        self.errors = 0
+        self.latency = Histogram()
+
+    def merge(self, other):
+        self.uses += other.uses
+        self.errors += other.errors
+        self.latency.merge(other.latency)
+
+    def to_dict(self):
+        return {'uses': self.uses, 'errors': self.errors, 'latency': self.latency.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.uses = int(data.get('uses', 0))
+        stats.errors = int(data.get('errors', 0))
+        stats.latency = Histogram.from_dict(data.get('latency', {}))
+        return stats
+
 
 class Stats(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.started_at = time.monotonic()
+        # command name -> CommandStats, since this cog was loaded
+        self.totals = defaultdict(CommandStats)
+        # same, but only what hasn't been written to the table yet
+        self._pending = defaultdict(CommandStats)
+        self.flush_stats.start()
+
+    def cog_unload(self):
+        self.flush_stats.cancel()
+
+    @property
+    def sort_key(self):
+        # each shard worker process keeps its own item, so flushes from different workers don't overwrite each other
+        shard_ids = getattr(self.bot, 'shard_ids', None)
+        return f"{STATS_SORT_KEY}-{shard_ids[0]}" if shard_ids else STATS_SORT_KEY
+
+    def record(self, ctx, error=False):
+        name = ctx.command.qualified_name
+        started = getattr(ctx, 'invoked_at', None)
+        for stats in (self.totals[name], self._pending[name]):
+            stats.uses += 1
+            if error:
+                stats.errors += 1
+            elif started is not None:
+                stats.latency.record(time.perf_counter() - started)
+
+    @commands.Cog.listener()
+    async def on_command_completion(self, ctx):
+        self.record(ctx)
 
     @commands.Cog.listener()
-    async def on_message(self, message):
-        pass
+    async def on_command_error(self, ctx, error):
+        if ctx.command is not None:
+            self.record(ctx, error=True)
+
+    async def flush(self):
+        """Adds stats recorded since the last flush to today's item in the table."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, defaultdict(CommandStats)
+        key = [int(datetime.date.today().strftime('%Y%m%d')), self.sort_key]
+        try:
+            try:
+                stored = await self.bot.table.aget(key)
+            except KeyError:
+                stored = {}
+            stored_stats = {name: CommandStats.from_dict(data) for name, data in stored.get('commands', {}).items()}
+            for name, stats in pending.items():
+                stored_stats.setdefault(name, CommandStats()).merge(stats)
+            await self.bot.table.aput({'commands': {name: stats.to_dict() for name, stats in stored_stats.items()}}, key)
+        except Exception:
+            self.bot.logger.error("Error writing command stats, will retry next flush.", exc_info=True)
+            for name, stats in pending.items():
+                self._pending[name].merge(stats)
+
+    @tasks.loop(minutes=STATS_FLUSH_INTERVAL)
+    async def flush_stats(self):
+        await self.flush()
+
+    @flush_stats.after_loop
+    async def after_flush_stats(self):
+        # last flush when the cog is unloaded or the bot closes
+        await self.flush()
+
+    @commands.command()
+    @checks.bulbe_perms('manager')
+    async def cmdstats(self, ctx, sort='uses', top: int = 15):
+        """Shows the most used (or 'slow', or 'errors') commands since the bot started."""
+        keys = {
+            'uses': lambda item: item[1].uses,
+            'errors': lambda item: item[1].errors,
+            'slow': lambda item: item[1].latency.percentile(0.95) or 0,
+        }
+        if sort not in keys:
+            return await ctx.send(f"Sort by one of: {', '.join(keys)}.")
+        uptime = time.monotonic() - self.started_at
+        rows = sorted(self.totals.items(), key=keys[sort], reverse=True)[:top]
+        lines = [f"{'command':<20} {'uses':>6} {'/min':>6} {'errs':>5} {'p50':>7} {'p95':>7} {'p99':>7}"]
+        for name, stats in rows:
+            percentiles = (stats.latency.percentile(q) for q in (0.5, 0.95, 0.99))
+            lines.append(f"{name[:20]:<20} {stats.uses:>6} {stats.uses / uptime * 60:>6.2f} {stats.errors:>5} "
+                         + " ".join(f"{p * 1000:>5.0f}ms" if p is not None else f"{'-':>7}" for p in percentiles))
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
 
 
 def setup(bot):
@@ -1,45 +1,137 @@
 
 import sys
-import psutil
 import datetime
+from collections import defaultdict, deque
 from typing import Union
 
 import discord
 from discord.ext import commands
 
+from boto3.dynamodb.conditions import Attr
+
+from utils import checks
 from utils.converters import FetchedUser
+from utils.db import ConditionFailed
 from utils.utility import status
 
 
+# members processed at once per guild, so a join wave doesn't pile hundreds of requests onto one rate limit bucket
+JOIN_CONCURRENCY = 5
+# log a warning when a guild's join backlog reaches this
+JOIN_BACKLOG_WARNING = 100
+
+
 class PersistManager:
-    """Conveniently handles guilds' rolePersist data."""
+    """
+    Conveniently handles guilds' rolePersist data.
+
+    Each member's roles are their own item, keyed [guild_id, 'rolePersist-<member_id>'], so joins
+    and leaves cost one small write each however many members a guild has stored. A join pops the
+    item in one atomic call, so concurrent joins can't restore the same roles twice.
+    """
     def __init__(self, cog):
         self.cog = cog
         self.bot = cog.bot
         self.table = cog.bot.table
 
+    @staticmethod
+    def key(guild_id, member_id):
+        return [guild_id, f"rolePersist-{member_id}"]
+
     async def get(self, member):
+        """Returns and forgets a member's stored role ids, or None."""
         try:
-            data = self.table.get([member.guild.id, 'rolePersist'])
-            roles = data.pop(str(member.id))
-            self.table.put(data, [member.guild.id, 'rolePersist'])
-            return roles
+            item = await self.table.apop(self.key(member.guild.id, member.id))
         except KeyError:
-            pass
+            return None
+        return [int(role_id) for role_id in item['roles']]
 
     async def put(self, member, role_ids):
+        key = self.key(member.guild.id, member.id)
+        if role_ids:
+            await self.table.aput({'roles': role_ids}, key)
+        else:
+            # clears roles stored by an earlier leave, deleting a missing item is a no-op
+            await self.table.adelete(key)
+
+    async def migrate(self):
+        """Splits old guild-wide [guild_id, 'rolePersist'] items into per-member items."""
+        guilds = await self.table.aread('rolePersist')
+        if not guilds:
+            return
+        self.bot.logger.info(f"Migrating role persist data for {len(guilds)} guilds to per-member items.")
+        # a member who left since another worker migrated has a newer item, which the old data mustn't overwrite
+        condition = Attr(self.table.primary_key).not_exists()
+        for data in guilds:
+            guild_id = int(data.pop(self.table.primary_key))
+            data.pop(self.table.sort_key)
+            for member_id, role_ids in data.items():
+                try:
+                    await self.table.aput({'roles': role_ids}, self.key(guild_id, int(member_id)), condition)
+                except ConditionFailed:
+                    pass
+            await self.table.adelete([guild_id, 'rolePersist'])
+
+
+class JoinQueue:
+    """
+    Queues joining members for autorole and role persist, per guild.
+
+    Each guild's backlog is drained by up to JOIN_CONCURRENCY workers, so a raid or mass invite
+    is handled concurrently without one guild's joins flooding discord's rate limits for the rest.
+    """
+    def __init__(self, cog):
+        self.cog = cog
+        self.bot = cog.bot
+        self._pending = defaultdict(deque)  # guild id -> members waiting
+        self._workers = defaultdict(int)    # guild id -> running workers
+
+    def depth(self, guild_id=None):
+        """Members waiting in one guild's backlog, or in every guild's."""
+        if guild_id is not None:
+            return len(self._pending.get(guild_id, ()))
+        return sum(len(pending) for pending in self._pending.values())
+
+    def put(self, member):
+        guild_id = member.guild.id
+        pending = self._pending[guild_id]
+        pending.append(member)
+        if len(pending) == JOIN_BACKLOG_WARNING:
+            self.bot.logger.warning(f"Join backlog for guild {guild_id} has reached {JOIN_BACKLOG_WARNING} members.")
+        if self._workers[guild_id] < JOIN_CONCURRENCY:
+            self._workers[guild_id] += 1
+            self.bot.loop.create_task(self._work(guild_id))
+
+    async def _work(self, guild_id):
+        pending = self._pending[guild_id]
         try:
-            data = self.table.get([member.guild.id, 'rolePersist'])
-        except KeyError:
-            data = {}
-        data[str(member.id)] = role_ids
-        self.table.put(data, [member.guild.id, 'rolePersist'])
+            while pending:
+                member = pending.popleft()
+                try:
+                    await self.cog.process_join(member)
+                except Exception:
+                    self.bot.logger.error(f"Error processing join of {member.id} in guild {guild_id}.", exc_info=True)
+        finally:
+            self._workers[guild_id] -= 1
+            if not self._workers[guild_id] and not pending:
+                del self._workers[guild_id]
+                del self._pending[guild_id]
 
 
 class Utilities(commands.Cog):
+    dependencies = ('Config',)
+
     def __init__(self, bot):
         self.bot = bot
         self.persist = PersistManager(self)
+        self.joins = JoinQueue(self)
+
+    async def cog_setup(self):
+        try:
+            await self.persist.migrate()
+        except Exception:
+            # the old items stay put, so the next startup tries again
+            self.bot.logger.error("Error migrating role persist data.", exc_info=True)
 
     async def get_autorole_persist_configs(self, guild):
         try:
@@ -65,33 +157,36 @@ class Utilities(commands.Cog):
         roles = [r for r in roles if r.position < member.guild.me.top_role.position]
         return roles
 
-    async def assign_autoroles(self, member, autorole_config):
-        roles = await self.validate_roles(member, autorole_config)
-        if roles:
-            await member.add_roles(*roles, reason="Autorole")
-
-    async def restore_member(self, member, persist_config):
-        roles = await self.persist.get(member)
-
+    async def process_join(self, member):
+        """Gives a member their autoroles and persisted roles, in a single add_roles call."""
+        if member.guild.get_member(member.id) is None:
+            # left while queued, keep any persisted roles for next time
+            return
+        autorole, persist = await self.get_autorole_persist_configs(member.guild)
+        restored = []
+        if persist:
+            restored = [r for r in await self.persist.get(member) or () if r in persist]
+        roles = await self.validate_roles(member, set(autorole or ()) | set(restored))
         if not roles:
             return
-
-        roles = [r for r in roles if r in persist_config]
-        roles = await self.validate_roles(member, roles)
-
-        if roles:
-            await member.add_roles(*roles, reason="Role persist")
-            self.bot.dispatch('member_restore', member, roles)
+        restored_roles = [r for r in roles if r.id in restored]
+        reasons = [reason for reason, present in (("Autorole", len(restored_roles) < len(roles)),
+                                                   ("Role persist", restored_roles)) if present]
+        await member.add_roles(*roles, reason=", ".join(reasons))
+        if restored_roles:
+            self.bot.dispatch('member_restore', member, restored_roles)
 
     @commands.Cog.listener()
     async def on_member_join(self, member):
         autorole, persist = await self.get_autorole_persist_configs(member.guild)
+        if autorole or persist:
+            self.joins.put(member)
 
-        if autorole:
-            await self.assign_autoroles(member, autorole)
-
-        if persist:
-            await self.restore_member(member, persist)
+    @commands.command()
+    @checks.bulbe_perms('manager')
+    async def joinqueue(self, ctx):
+        """Shows how many joins are waiting for autorole and role persist."""
+        await ctx.send(f"Join backlog: {self.joins.depth(ctx.guild.id)} in this server, {self.joins.depth()} total.")
 
     @commands.Cog.listener()
     async def on_member_remove(self, member):
@@ -186,6 +281,7 @@ class Utilities(commands.Cog):
             uptime = f"{dt.seconds} seconds"
 
         embed.add_field(name="Uptime", value=uptime)
+        import psutil  # only needed here, so it isn't imported at cog load
         memory = int(psutil.Process().memory_info().rss//10**6)
         embed.add_field(name="Memory", value=f"{memory} MB")
         embed.add_field(name="Servers", value=len(self.bot.guilds))
@@ -124,12 +124,10 @@ class Admin(commands.Cog):
     @commands.command()
     async def load(self, ctx, *, cog):
         """Loads a cog."""
-        try:
-            self.bot.load_extension(cog)
-        except commands.ExtensionError as e:
-            await ctx.send(f'{e.__class__.__name__}: {e}')
-        else:
+        if cog in await self.bot.load_extensions([cog]):
             await ctx.send(f'Loaded {cog}.')
+        else:
+            await ctx.send(f'Failed to load {cog}. Check the logs for details.')
 
     @commands.command()
     async def unload(self, ctx, *, cog):
@@ -148,8 +146,11 @@ class Admin(commands.Cog):
             self.bot.reload_extension(cog)
         except commands.ExtensionError as e:
             await ctx.send(f'{e.__class__.__name__}: {e}')
-        else:
+            return
+        if cog in await self.bot.setup_extensions([cog]):
             await ctx.send(f'Reloaded {cog}.')
+        else:
+            await ctx.send(f'Failed to set up {cog}. Check the logs for details.')
 
     @commands.command()
     async def sudo(self, ctx, channel: typing.Optional[converters.GlobalChannel], who: discord.User, *, command: str):
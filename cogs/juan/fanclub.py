@@ -25,6 +25,21 @@ DEV_CHANNELS_CATEGORY = 577706266768703488
 MOD_BOTS_ROLE = 590977954474098700
 BOT_LORDS_ROLE = 664328292522000424
 
+# roles only bots may have
+BOT_ONLY_ROLES = frozenset({BOTS_ROLE, BOT_LORDS_ROLE, MOD_BOTS_ROLE})
+# hours between full role cleanup sweeps. on_member_update catches most changes in between
+CLEANUP_SWEEP_HOURS = 12
+# seconds between role cleanup removals, so a sweep doesn't flood the member edit rate limit
+CLEANUP_REMOVAL_DELAY = 1
+# seconds a guild's fetched bot_add audit log entries are reused for
+AUDIT_LOG_TTL = 30
+# bot_add entries fetched per refresh, enough for a burst of bot joins
+AUDIT_LOG_LIMIT = 25
+# discord can write a bot_add entry a few seconds after the join. a miss fetched within this many seconds
+# of the join is retried once, after AUDIT_LOG_RETRY_DELAY seconds, instead of being trusted
+AUDIT_LOG_LAG = 5
+AUDIT_LOG_RETRY_DELAY = 2
+
 
 pattern = re.compile(r"^= ([\w| ]+) =$")
 
@@ -54,70 +69,154 @@ def get_category_list(roles):
     return categories
 
 
+def snowflake(obj):
+    """Returns an id from an int, Decimal or anything with an id attribute (Member, TextChannel, Role...)."""
+    return int(getattr(obj, 'id', obj))
+
+
 class DevData:
+    """
+    Developers' devData items ([user_id, 'devData']: bots, devChannel, botRole), cached in memory.
+
+    Everything is read from the table once in load(), with reverse indexes from bot, channel and role
+    ids to their owners, so lookups don't scan the table. put() writes through to the table.
+    """
     def __init__(self, cog):
         self.cog = cog
         self.bot = cog.bot
         self.table = cog.table
-
-    def get(self, user_id, key=None):
-        try:
-            if key:
-                return self.table.get([user_id, 'devData'])[key]
-            else:
-                return self.table.get([user_id, 'devData'])
-        except KeyError:
-            return None
-
-    def put(self, new_data, user_id):
-        try:
-            data = self.table.get([user_id, 'devData'])
-        except KeyError:
-            data = {}
-        data.update(new_data)
-        self.table.put(data, [user_id, 'devData'])
-
-    def get_all(self):
-        data = self.table.read('devData')
-        for item in data:
+        self._data = dict()  # user id -> devData item
+        # bot id -> user ids, since a bot can be registered to more than one user
+        self._bot_owners = collections.defaultdict(set)
+        self._channel_owners = dict()  # dev channel id -> user id
+        self._role_owners = dict()  # bot role id -> user id
+        self._lock = asyncio.Lock()
+
+    async def load(self):
+        items = await self.table.aread('devData')
+        self._data.clear()
+        self._bot_owners.clear()
+        self._channel_owners.clear()
+        self._role_owners.clear()
+        for item in items:
+            user_id = int(item.pop('snowflake'))
             item.pop('dataType')
-            item['user'] = item.pop('snowflake')
-        return data
+            self._data[user_id] = self._normalize(item)
+            self._index(user_id)
 
-    def get_bot(self, bot_id):
-        data = self.get_all()
-        for user_data in data:
-            for bot_data in user_data['bots']:
-                if bot_data['id'] == bot_id:
-                    bot_data['owner'] = user_data['user']
-                    return bot_data
-        return None
+    @staticmethod
+    def _normalize(data):
+        """Makes every id in a devData item an int. The table returns Decimals."""
+        for bot_data in data.get('bots', []):
+            bot_data['id'] = snowflake(bot_data['id'])
+        for key in ('devChannel', 'botRole'):
+            if data.get(key) is not None:
+                data[key] = snowflake(data[key])
+        return data
 
-    def whose_bot(self, bot_id):
-        data = self.get_all()
-        for user_data in data:
-            for bot_data in user_data['bots']:
+    def _index(self, user_id):
+        data = self._data[user_id]
+        for bot_data in data.get('bots', []):
+            self._bot_owners[int(bot_data['id'])].add(user_id)
+        if data.get('devChannel') is not None:
+            self._channel_owners[int(data['devChannel'])] = user_id
+        if data.get('botRole') is not None:
+            self._role_owners[int(data['botRole'])] = user_id
+
+    def _unindex(self, user_id):
+        data = self._data.get(user_id, {})
+        for bot_data in data.get('bots', []):
+            owners = self._bot_owners.get(int(bot_data['id']))
+            if owners:
+                owners.discard(user_id)
+                if not owners:
+                    del self._bot_owners[int(bot_data['id'])]
+        if data.get('devChannel') is not None and self._channel_owners.get(int(data['devChannel'])) == user_id:
+            del self._channel_owners[int(data['devChannel'])]
+        if data.get('botRole') is not None and self._role_owners.get(int(data['botRole'])) == user_id:
+            del self._role_owners[int(data['botRole'])]
+
+    async def get(self, user_id, key=None):
+        # copies, since callers edit what they get before passing it back to put
+        data = self._data.get(snowflake(user_id))
+        if data is None:
+            return None
+        if key:
+            return copy.deepcopy(data.get(key))
+        return copy.deepcopy(data)
+
+    async def put(self, new_data, user_id):
+        user_id = snowflake(user_id)
+        async with self._lock:
+            data = copy.deepcopy(self._data.get(user_id, {}))
+            data.update(new_data)
+            self._normalize(data)
+            await self.table.aput(copy.deepcopy(data), [user_id, 'devData'])
+            self._unindex(user_id)
+            self._data[user_id] = data
+            self._index(user_id)
+
+    async def get_all(self):
+        return [dict(copy.deepcopy(data), user=user_id) for user_id, data in self._data.items()]
+
+    def owners(self, bot_id):
+        """Every user a bot is registered to."""
+        return sorted(self._bot_owners.get(snowflake(bot_id), ()))
+
+    async def get_bot(self, bot_id):
+        bot_id = snowflake(bot_id)
+        for user_id in self.owners(bot_id):
+            for bot_data in self._data[user_id]['bots']:
                 if bot_data['id'] == bot_id:
-                    return user_data['user']
+                    return dict(copy.deepcopy(bot_data), owner=user_id)
         return None
 
-    def whose_channel(self, channel_id):
-        data = self.get_all()
-        for user_data in data:
-            if 'devChannel' not in user_data.keys():
-                continue
-            if user_data['devChannel'] == channel_id:
-                return user_data['user']
-        return None
-
-    def whose_role(self, role_id):
-        data = self.get_all()
-        for user_data in data:
-            if 'botRole' not in user_data.keys():
-                continue
-            if user_data['botRole'] == role_id:
-                return user_data['user']
-        return None
+    def bot_count(self, user_id):
+        return len(self._data.get(snowflake(user_id), {}).get('bots', []))
+
+    async def whose_bot(self, bot_id):
+        owners = self.owners(bot_id)
+        return owners[0] if owners else None
+
+    async def whose_channel(self, channel_id):
+        return self._channel_owners.get(snowflake(channel_id))
+
+    async def whose_role(self, role_id):
+        return self._role_owners.get(snowflake(role_id))
+
+
+class BotAdds:
+    """
+    Who added which bot, from each guild's recent bot_add audit log entries.
+
+    Entries are fetched once and reused for AUDIT_LOG_TTL seconds, so a burst of bot joins shares one
+    audit log request. A guild is only refetched early for a bot that joined after the last fetch,
+    or once more if the bot's entry may not have been written yet when it was fetched.
+    """
+    def __init__(self):
+        self._adders = dict()  # guild id -> (fetched at, {bot id: user who added it})
+        self._locks = collections.defaultdict(asyncio.Lock)
+
+    async def _fetch(self, guild):
+        adders = dict()
+        async for entry in guild.audit_logs(limit=AUDIT_LOG_LIMIT, action=discord.AuditLogAction.bot_add):
+            # newest first, so a bot that was added more than once keeps its latest adder
+            adders.setdefault(entry.target.id, entry.user)
+        self._adders[guild.id] = (datetime.datetime.utcnow(), adders)
+        return self._adders[guild.id]
+
+    async def added_by(self, member):
+        # joins waiting on the lock find the entries the first one fetched
+        async with self._locks[member.guild.id]:
+            fetched_at, adders = self._adders.get(member.guild.id, (None, {}))
+            stale = fetched_at is None or (datetime.datetime.utcnow() - fetched_at).total_seconds() > AUDIT_LOG_TTL
+            if stale or (member.id not in adders and (member.joined_at is None or fetched_at < member.joined_at)):
+                fetched_at, adders = await self._fetch(member.guild)
+            if member.id not in adders and member.joined_at is not None \
+                    and (fetched_at - member.joined_at).total_seconds() < AUDIT_LOG_LAG:
+                await asyncio.sleep(AUDIT_LOG_RETRY_DELAY)
+                fetched_at, adders = await self._fetch(member.guild)
+            return adders.get(member.id)
 
 
 class FanClub(commands.Cog):
@@ -125,55 +224,131 @@ class FanClub(commands.Cog):
         self.bot = bot
         self.table = self.bot.table
         self.dev_data = DevData(self)
+        self.bot_adds = BotAdds()
+        # ids of the "= Category =" separator roles, which nobody should have
+        self._category_role_ids = frozenset()
+        # members waiting for role cleanup, handled one at a time by process_cleanup_queue
+        self._cleanup_queue = asyncio.Queue()
+        self._cleanup_queued = set()
+        self._cleanup_task = None
+
+    async def cog_setup(self):
+        await self.dev_data.load()
+        # on_ready doesn't fire again when the cog is reloaded
+        if self.bot.is_ready():
+            self.start_cleanup()
+
+    def cog_unload(self):
+        self.cleanup_roles.cancel()
+        if self._cleanup_task:
+            self._cleanup_task.cancel()
 
     @commands.Cog.listener()
     async def on_ready(self):
-        self.cleanup_roles.start()
-
-    @tasks.loop(minutes=30)
+        self.start_cleanup()
+
+    def start_cleanup(self):
+        """Starts the cleanup sweep and queue worker, unless they're running. Safe to call again, as on_ready does after reconnects."""
+        if not self.cleanup_roles.is_running():
+            self.cleanup_roles.start()
+        if self._cleanup_task is None or self._cleanup_task.done():
+            self._cleanup_task = self.bot.loop.create_task(self.process_cleanup_queue())
+
+    def refresh_forbidden_roles(self, guild):
+        self._category_role_ids = frozenset(role.id for role in get_category_list(guild.roles))
+
+    def forbidden_roles(self, member):
+        """Ids of the roles a member has but shouldn't."""
+        role_ids = {role.id for role in member.roles}
+        forbidden = role_ids & self._category_role_ids
+        if not member.bot:
+            forbidden |= role_ids & BOT_ONLY_ROLES
+        return forbidden
+
+    def queue_cleanup(self, member):
+        if member.id not in self._cleanup_queued:
+            self._cleanup_queued.add(member.id)
+            self._cleanup_queue.put_nowait(member.id)
+
+    async def process_cleanup_queue(self):
+        while True:
+            member_id = await self._cleanup_queue.get()
+            self._cleanup_queued.discard(member_id)
+            try:
+                removed = await self.clean_member(member_id)
+            except Exception:
+                self.bot.logger.error(f"Error cleaning up roles of {member_id}.", exc_info=True)
+                removed = True
+            if removed:
+                await asyncio.sleep(CLEANUP_REMOVAL_DELAY)
+
+    async def clean_member(self, member_id):
+        """Removes a member's forbidden roles in one call. Returns whether there were any."""
+        guild = self.bot.get_guild(self.bot.properties.guild)
+        member = guild.get_member(member_id) if guild else None
+        if not member:
+            return False
+        # checked again now, the member's roles may have changed while queued
+        roles = [guild.get_role(role_id) for role_id in self.forbidden_roles(member)]
+        if not roles:
+            return False
+        await member.remove_roles(*roles, reason="Role cleanup")
+        return True
+
+    @tasks.loop(hours=CLEANUP_SWEEP_HOURS)
     async def cleanup_roles(self):
+        """Reconciliation sweep, for anything on_member_update missed (e.g. while disconnected)."""
         guild = self.bot.get_guild(self.bot.properties.guild)
-        category_roles = get_category_list(guild.roles)
-        bot_roles = [guild.get_role(role) for role in [BOTS_ROLE, BOT_LORDS_ROLE, MOD_BOTS_ROLE]]
-        dev_bot_roles = sort_roles(guild.roles).get('Special Bot Roles')
+        self.refresh_forbidden_roles(guild)
         for member in guild.members:
-            for role in category_roles:
-                if role in member.roles:
-                    await member.remove_roles(*category_roles, reason="Role cleanup")
-                    break
-            if not member.bot:
-                for role in bot_roles:
-                    if role in member.roles:
-                        await member.remove_roles(*bot_roles, reason="Role cleanup")
-                        break
-                # for role in dev_bot_roles:
-                #     if role in member.roles:
-                #         await member.remove_roles(*dev_bot_roles, reason="Role cleanup")
-                #         break
-
-    def get_bots(self, user):
+            if self.forbidden_roles(member):
+                self.queue_cleanup(member)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        if after.guild.id != self.bot.properties.guild or before.roles == after.roles:
+            return
+        if self.forbidden_roles(after):
+            self.queue_cleanup(after)
+
+    @commands.Cog.listener()
+    async def on_guild_role_create(self, role):
+        if role.guild.id == self.bot.properties.guild:
+            self.refresh_forbidden_roles(role.guild)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        if role.guild.id == self.bot.properties.guild:
+            self.refresh_forbidden_roles(role.guild)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before, after):
+        if after.guild.id == self.bot.properties.guild and before.name != after.name:
+            self.refresh_forbidden_roles(after.guild)
+
+    async def get_bots(self, user):
         if isinstance(user, int) or isinstance(user, decimal.Decimal):
-            return self.dev_data.get(user, 'bots')
-        return self.dev_data.get(user.id, 'bots')
+            return await self.dev_data.get(user, 'bots')
+        return await self.dev_data.get(user.id, 'bots')
 
-    def get_dev_channel(self, user):
+    async def get_dev_channel(self, user):
         if isinstance(user, int) or isinstance(user, decimal.Decimal):
-            return self.dev_data.get(user, 'devChannel')
-        return self.dev_data.get(user.id, 'devChannel')
+            return await self.dev_data.get(user, 'devChannel')
+        return await self.dev_data.get(user.id, 'devChannel')
 
-    def get_bot_role(self, user):
+    async def get_bot_role(self, user):
         if isinstance(user, int) or isinstance(user, decimal.Decimal):
-            return self.dev_data.get(user, 'botRole')
-        return self.dev_data.get(user.id, 'botRole')
+            return await self.dev_data.get(user, 'botRole')
+        return await self.dev_data.get(user.id, 'botRole')
 
-    def update_dev_data(self, new_data, user_id, key):
+    async def update_dev_data(self, new_data, user_id, key):
         data = {key: new_data}
-        self.dev_data.put(data, user_id)
+        await self.dev_data.put(data, user_id)
 
-    def register_bot(self, user, bot_data):
+    async def register_bot(self, user, bot_data):
         user_id = user if isinstance(user, int) or isinstance(user, decimal.Decimal) else user.id
         bot_data['timestamp'] = str(datetime.datetime.now())
-        bots = self.get_bots(user_id)
+        bots = await self.get_bots(user_id)
         if bots:
             for bot in bots:
                 if bot['id'] == bot_data['id']:
@@ -181,14 +356,21 @@ class FanClub(commands.Cog):
         else:
             bots = []
         bots.append(bot_data)
-        self.update_dev_data(bots, user_id, 'bots')
+        await self.update_dev_data(bots, user_id, 'bots')
 
-    @staticmethod
-    async def added_by(member):
-        async for entry in member.guild.audit_logs(limit=10, action=discord.AuditLogAction.bot_add):
-            if entry.target == member:
-                return entry.user
-        return None
+    async def added_by(self, member):
+        return await self.bot_adds.added_by(member)
+
+    async def get_user(self, user_id, guild=None):
+        """Looks a user up in the member and user caches before asking the API."""
+        user_id = snowflake(user_id)
+        user = (guild.get_member(user_id) if guild else None) or self.bot.get_user(user_id)
+        if user:
+            return user
+        try:
+            return await self.bot.fetch_user(user_id)
+        except discord.NotFound:
+            return None
 
     async def handle_unregistered_bot(self, member):
         added_by = await self.added_by(member)
@@ -207,12 +389,9 @@ class FanClub(commands.Cog):
         timestamp = bot_data['timestamp'] if 'timestamp' in bot_data.keys() else "No timestamp"
         owner_id = bot_data['owner'] if 'owner' in bot_data.keys() else None
 
-        bot_role_id = self.get_bot_role(owner_id)
+        bot_role_id = await self.get_bot_role(owner_id)
 
-        try:
-            owner = await self.bot.fetch_user(owner_id)
-        except discord.NotFound:
-            owner = None
+        owner = await self.get_user(owner_id, member.guild) if owner_id else None
         added_by_id = added_by.id if added_by else None
 
         self.bot.dispatch('bot_add', member, added_by, owner)
@@ -233,14 +412,13 @@ class FanClub(commands.Cog):
         general = self.bot.get_channel(self.bot.properties.channels['general'])
         await general.send(f"{added_by.mention if added_by else None} has added bot {member.mention} to the server!")
 
-        if not owner or owner not in member.guild.members:
+        # get_user returns a Member if the owner is in the server
+        if not isinstance(owner, discord.Member):
             return
-        owner = member.guild.get_member(owner.id)
 
-        bots = self.get_bots(owner)
-        if len(bots) == 1:
+        if self.dev_data.bot_count(owner) == 1:
             role = member.guild.get_role(DEVELOPER_ROLE)
-            if role not in member.roles:
+            if role not in owner.roles:
                 await owner.add_roles(role, reason="First bot! 🎉")
             await general.send(f"Congrats {owner.mention} on adding your first bot! 🎉")
 
@@ -254,7 +432,7 @@ class FanClub(commands.Cog):
             await general.send(f"Welcome {member.mention}!")
             await member.add_roles(visitor_role, reason="Autorole")
             return
-        bot_data = self.dev_data.get_bot(member.id)
+        bot_data = await self.dev_data.get_bot(member.id)
         await asyncio.sleep(2)
         if bot_data:
             await self.handle_registered_bot(member, bot_data)
@@ -264,36 +442,36 @@ class FanClub(commands.Cog):
     @commands.command()
     async def bots(self, ctx, who: discord.Member = None):
         who = who if who else ctx.author
-        bots = self.get_bots(who.id)
+        bots = await self.get_bots(who.id)
         for bot_info in bots:
             for key, value in bot_info.items():
-                if isinstance(value, decimal.Decimal):
+                if isinstance(value, (int, decimal.Decimal)):
                     bot_info[key] = str(self.bot.get_user(int(value)))
         formatted = yaml.dump(bots)
         await ctx.send(f"```{formatted}```")
 
     @commands.command()
     async def bot(self, ctx, who: discord.Member):
-        bot_info = self.dev_data.get_bot(who)
+        bot_info = await self.dev_data.get_bot(who)
         for key, value in bot_info.items():
-            if isinstance(value, decimal.Decimal):
+            if isinstance(value, (int, decimal.Decimal)):
                 bot_info[key] = str(self.bot.get_user(int(value)))
         formatted = yaml.dump(bot_info)
         await ctx.send(f"```{formatted}```")
 
     @commands.command()
     async def whosebot(self, ctx, bot: discord.Member):
-        owner = self.dev_data.whose_bot(bot.id)
+        owner = await self.dev_data.whose_bot(bot.id)
         await ctx.send(f"This bot is registered to {owner}.")
 
     @commands.command()
     async def whosechannel(self, ctx, channel: discord.TextChannel):
-        owner = self.dev_data.whose_channel(channel.id)
+        owner = await self.dev_data.whose_channel(channel.id)
         await ctx.send(f"This channel is registered to {owner}.")
 
     @commands.command()
     async def whoserole(self, ctx, role: discord.Role):
-        owner = self.dev_data.whose_role(role.id)
+        owner = await self.dev_data.whose_role(role.id)
         await ctx.send(f"This role is registered to {owner}.")
 
     @commands.command()
@@ -305,7 +483,7 @@ class FanClub(commands.Cog):
                 'prefix': prefix
             }
             owner = await self.bot.fetch_user(owner_id)
-            self.register_bot(owner, data)
+            await self.register_bot(owner, data)
             await ctx.send(f"Registered {bot_id} to {owner_id}.")
         except Exception as e:
             await ctx.send(str(e))
@@ -318,7 +496,7 @@ class FanClub(commands.Cog):
             'id': bot_id,
             'prefix': prefix
         }
-        self.register_bot(ctx.author, data)
+        await self.register_bot(ctx.author, data)
 
         manage_guild = ctx.guild.get_role(MANAGE_GUILD)
         await ctx.author.add_roles(manage_guild, reason=f"Perms to add bot, client id {bot_id}")
@@ -338,24 +516,21 @@ class FanClub(commands.Cog):
     @commands.command()
     @checks.is_developer()
     async def register(self, ctx, bot: discord.Member, prefix):
-        owner_id = self.dev_data.whose_bot(bot)
+        owner_id = await self.dev_data.whose_bot(bot)
         if owner_id:
-            try:
-                owner = await self.bot.fetch_user(owner_id)
-            except discord.NotFound:
-                owner = None
+            owner = await self.get_user(owner_id, ctx.guild)
             await ctx.send(f"{bot} is already owned by {owner if owner else owner_id}!")
         data = {
             'id': bot.id,
             'prefix': prefix
         }
-        self.register_bot(ctx.author, data)
-        role = self.get_bot_role(ctx.author)
+        await self.register_bot(ctx.author, data)
+        role = await self.get_bot_role(ctx.author)
         if role:
             role = ctx.guild.get_role(role)
             if role:
                 try:
-                    timestamp = self.dev_data.get_bot(bot.id)['timestamp']
+                    timestamp = (await self.dev_data.get_bot(bot.id))['timestamp']
                 except TypeError:
                     timestamp = None
                 await bot.add_roles(role, reason=f"Registered to {ctx.author} ({ctx.author.id}) [{timestamp}]")
@@ -365,16 +540,12 @@ class FanClub(commands.Cog):
     @checks.is_admin()
     async def unregister(self, ctx, bot_id: int):
         n = 0
-        while (bot_data := self.dev_data.get_bot(bot_id)) is not None:
-            user_id = bot_data.pop('owner')
-            bots = self.dev_data.get(user_id, 'bots')
-            for bot in bots:
-                if bot['id'] == bot_id:
-                    n += 1
-                    bots.remove(bot)
-                    await ctx.send(f"Removed from bots owned by user {user_id}.")
-
-            self.update_dev_data(bots, user_id, 'bots')
+        for user_id in self.dev_data.owners(bot_id):
+            bots = await self.dev_data.get(user_id, 'bots')
+            remaining = [bot for bot in bots if bot['id'] != bot_id]
+            n += len(bots) - len(remaining)
+            await ctx.send(f"Removed from bots owned by user {user_id}.")
+            await self.update_dev_data(remaining, user_id, 'bots')
         await ctx.send(f"Done. Bot was registered {n} times.")
 
     @commands.command()
@@ -383,24 +554,24 @@ class FanClub(commands.Cog):
         if channel.category.id != DEV_CHANNELS_CATEGORY:
             await ctx.send("Channel must be in \"Dev Channels\" category.")
             return
-        owner = self.dev_data.whose_channel(channel)
+        owner = await self.dev_data.whose_channel(channel)
         if owner:
             await ctx.send(f"That channel is owned by {owner}.")
             return
-        self.update_dev_data(channel.id, ctx.author.id, 'devChannel')
+        await self.update_dev_data(channel.id, ctx.author.id, 'devChannel')
         await ctx.send("Done!")
 
     @commands.command()
     @checks.is_developer()
     async def claimrole(self, ctx, role: discord.Role):
-        owner = self.dev_data.whose_role(role)
+        owner = await self.dev_data.whose_role(role)
         if owner:
             await ctx.send(f"That role is owned by {owner}.")
             return
         sorted_roles = sort_roles(ctx.guild.roles)
         if role not in sorted_roles['Special Bot Roles']:
             await ctx.send("Role must be in \"Special Bot Roles\" category.")
-        self.update_dev_data(role.id, ctx.author.id, 'botRole')
+        await self.update_dev_data(role.id, ctx.author.id, 'botRole')
         await ctx.send("Done!")
 
 
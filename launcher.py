@@ -1,18 +1,30 @@
 
+# recorded before anything else is imported, for the startup-time report
+import time
+_process_started = time.monotonic()
+
+import os
 import sys
+import importlib
+import tempfile
 import yaml
+import queue
 import logging
+import multiprocessing
 from argparse import ArgumentParser
 
+import sdnotify
+
 from discord.ext import commands
 
-from bots import evalbot, bulbe, revbot, juan, clippy
+# bot modules are imported by load_bot_class, so only the selected bot's dependencies get loaded
 # from bots import marvin
 from utils import checks
 from authentication import authentication
-from utils.utility import setup_logger, module_logger, HOME_DIR
+from utils.utility import setup_logger, module_logger, set_log_worker, HOME_DIR
 
 
+# bot name -> 'module.ClassName' in the bots package
 bots = {
     'bulbe': 'bulbe.Bulbe',
     'kippy': 'bulbe.Bulbe',
@@ -21,6 +33,14 @@ bots = {
 }
 
 
+# seconds a worker can go without a watchdog ping before the supervisor stops forwarding WATCHDOG=1
+WORKER_WATCHDOG_TIMEOUT = 20
+# same, for workers that haven't reported READY=1 yet
+WORKER_STARTUP_TIMEOUT = 300
+# seconds to wait before restarting a worker that crashed
+WORKER_RESTART_DELAY = 5
+
+
 class Debug(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -36,7 +56,7 @@ class Debug(commands.Cog):
         await ctx.send("hello.")
 
 
-def start(name, debug=False):
+def start(name, debug=False, notifier=None, **bot_kwargs):
     if sys.platform != 'linux' or debug:
         level = logging.DEBUG
     else:
@@ -49,30 +69,33 @@ def start(name, debug=False):
 
     if name in bots.keys():
         classname = bots[name]
-    else:
-        classname = None
-
-    bot = None
-
-    if classname == 'revbot.RevBot':
-        logger.debug("RevBot class selected. Initializing.")
-        bot = revbot.RevBot(command_prefix='__', name=name, logger=bot_logger)
-    elif classname == 'bulbe.Bulbe':
-        logger.debug("Bulbe class selected. Initializing.")
-        bot = bulbe.Bulbe(name=name, logger=bot_logger)
-    elif classname == 'evalbot.EvalBot':
-        logger.debug("EvalBot class selected. Initializing.")
-        bot = evalbot.EvalBot()
-    elif classname == 'juan.Juandissimo':
-        logger.debug("Juandissimo class selected. Initializing.")
-        bot = juan.Juandissimo(bot_logger)
-    elif classname == 'clippy.Clippy':
-        logger.debug("Clippy class selected. Initializing.")
-        bot = clippy.Clippy(bot_logger)
     else:
         logger.error("No class found. Closing.")
         exit(1)
 
+    launcher_done = time.monotonic()
+    logger.debug(f"{classname} class selected. Importing.")
+    bot_class = load_bot_class(classname)
+    import_done = time.monotonic()
+
+    logger.debug("Initializing.")
+    if classname == 'evalbot.EvalBot':
+        bot = bot_class()
+    elif classname in ('revbot.RevBot', 'bulbe.Bulbe'):
+        bot = bot_class(name=name, logger=bot_logger, notifier=notifier, **bot_kwargs)
+    else:
+        # bots with a fixed name take the logger as their only positional argument
+        bot = bot_class(bot_logger, notifier=notifier, **bot_kwargs)
+    init_done = time.monotonic()
+
+    if hasattr(bot, 'mark_phase'):
+        bot.mark_phase('process start', _process_started)
+        bot.mark_phase('bot import', launcher_done)
+
+    logger.info(f"Startup time: launcher {launcher_done - _process_started:.2f}s, "
+                f"bot import {import_done - launcher_done:.2f}s, "
+                f"bot init {init_done - import_done:.2f}s.")
+
     if sys.platform != 'linux' or debug:
         try:
             logger.info("Adding debug cog.")
@@ -93,15 +116,173 @@ def start(name, debug=False):
         exit(exit_code)
 
 
+def load_bot_class(classname):
+    """Imports and returns a bot class from its 'module.ClassName' string in the bots dict."""
+    module_name, class_name = classname.split('.')
+    module = importlib.import_module(f"bots.{module_name}")
+    return getattr(module, class_name)
+
+
+class WorkerNotifier:
+    """Stands in for sdnotify.SystemdNotifier in a shard worker, sending notifications to the supervisor instead."""
+    def __init__(self, worker_id, notify_queue):
+        self.worker_id = worker_id
+        self.queue = notify_queue
+
+    def notify(self, state):
+        self.queue.put((self.worker_id, state))
+
+
+def run_worker(name, debug, worker_id, notify_queue, shard_ids, shard_count, bot_kwargs):
+    """Entry point for a shard worker process."""
+    set_log_worker(worker_id)
+    start(name, debug, notifier=WorkerNotifier(worker_id, notify_queue),
+          shard_ids=shard_ids, shard_count=shard_count, **bot_kwargs)
+
+
+def shard_ranges(shard_count, processes):
+    """Splits shards 0..shard_count-1 into contiguous ranges, one per process."""
+    per_process, extra = divmod(shard_count, processes)
+    ranges = []
+    first = 0
+    for i in range(processes):
+        last = first + per_process + (1 if i < extra else 0)
+        ranges.append(list(range(first, last)))
+        first = last
+    return ranges
+
+
+def supervise(name, processes, shard_count=None, debug=False, profile=False, metrics_port=None):
+    """
+    Runs a bot as several worker processes, each owning a range of shards.
+    Restarts workers that crash, and is the only process that talks to systemd:
+    READY=1 once every worker is ready, WATCHDOG=1 only while every worker is pinging.
+    """
+    setup_logger(name)
+    logger = module_logger(name, "launcher", logging.DEBUG if debug else logging.INFO)
+    shard_count = shard_count if shard_count else processes
+    if shard_count < processes:
+        logger.error(f"Can't run {shard_count} shards in {processes} processes.")
+        exit(1)
+
+    notifier = sdnotify.SystemdNotifier() if sys.platform == 'linux' else None
+    mp = multiprocessing.get_context('spawn')
+    notify_queue = mp.Queue()
+    ranges = shard_ranges(shard_count, processes)
+    workers = dict()
+    ready = set()
+    last_ping = dict()
+    restart_at = dict()
+    bot_kwargs = dict(profile=True) if profile else dict()
+
+    if bots.get(name) == 'bulbe.Bulbe':
+        from utils.config_cache import ConfigCacheServer
+        from utils.db import Table
+        # one copy of the guild configs for every worker on this host
+        path = os.path.join(tempfile.gettempdir(), f"{name}-config-cache.sock")
+        cache = ConfigCacheServer(path, lambda: Table(name.capitalize()).read_to_dict('config'), logger)
+        cache.start_thread()
+        bot_kwargs['config_cache'] = path
+
+    def spawn(worker_id):
+        shard_ids = ranges[worker_id]
+        worker_kwargs = dict(bot_kwargs)
+        if metrics_port:
+            # each worker serves its own metrics, on consecutive ports
+            worker_kwargs['metrics_port'] = metrics_port + worker_id
+        process = mp.Process(target=run_worker, name=f"{name}-{worker_id}",
+                             args=(name, debug, worker_id, notify_queue, shard_ids, shard_count, worker_kwargs))
+        process.start()
+        workers[worker_id] = process
+        last_ping[worker_id] = time.monotonic()
+        logger.info(f"Started worker {worker_id} (pid {process.pid}) with shards {shard_ids}.")
+
+    logger.info(f"Starting {name} with {processes} processes and {shard_count} shards.")
+    for worker_id in range(processes):
+        spawn(worker_id)
+
+    def healthy(worker_id, now):
+        if worker_id in restart_at:
+            return True
+        timeout = WORKER_WATCHDOG_TIMEOUT if worker_id in ready else WORKER_STARTUP_TIMEOUT
+        return now - last_ping[worker_id] < timeout
+
+    try:
+        while workers:
+            try:
+                worker_id, state = notify_queue.get(timeout=1)
+            except queue.Empty:
+                pass
+            else:
+                now = time.monotonic()
+                if state == 'READY=1' and worker_id not in ready:
+                    ready.add(worker_id)
+                    logger.info(f"Worker {worker_id} is ready ({len(ready)}/{processes}).")
+                    if len(ready) == processes and notifier:
+                        notifier.notify('READY=1')
+                elif state == 'WATCHDOG=1':
+                    last_ping[worker_id] = now
+                elif state.startswith('STATUS=') and notifier:
+                    notifier.notify(f"STATUS=worker {worker_id}: {state[len('STATUS='):]}")
+
+            now = time.monotonic()
+            for worker_id, process in list(workers.items()):
+                if process.is_alive():
+                    continue
+                process.join()
+                ready.discard(worker_id)
+                if process.exitcode == 0:
+                    logger.info(f"Worker {worker_id} exited with code {process.exitcode}.")
+                    del workers[worker_id]
+                elif worker_id not in restart_at:
+                    logger.error(f"Worker {worker_id} exited with code {process.exitcode}. "
+                                 f"Restarting in {WORKER_RESTART_DELAY} seconds.")
+                    restart_at[worker_id] = now + WORKER_RESTART_DELAY
+
+            for worker_id, when in list(restart_at.items()):
+                if now >= when:
+                    del restart_at[worker_id]
+                    spawn(worker_id)
+
+            if notifier and workers and all(healthy(worker_id, now) for worker_id in workers):
+                notifier.notify('WATCHDOG=1')
+
+    except KeyboardInterrupt:
+        # SIGINT reaches the whole process group, so workers are already shutting down
+        logger.info("Received SIGINT, waiting for workers to exit.")
+        for process in workers.values():
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+    logger.info("All workers have exited.")
+
+
 def main():
 
     parser = ArgumentParser(description="Start a bot")
     parser.add_argument('bot')
     parser.add_argument('--debug', '-d', action='store_true')
+    parser.add_argument('--processes', '-p', type=int, default=1,
+                        help="number of shard worker processes (default: run in this process)")
+    parser.add_argument('--shards', '-s', type=int, default=None,
+                        help="total shard count when using --processes (default: one per process)")
+    parser.add_argument('--profile', action='store_true',
+                        help="profile event loop lag and slow callbacks (slows the bot down)")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="serve Prometheus metrics on this localhost port (workers use consecutive ports)")
 
     args = parser.parse_args()
 
-    start(args.bot, args.debug)
+    if args.processes > 1:
+        supervise(args.bot, args.processes, args.shards, args.debug, args.profile, args.metrics_port)
+    else:
+        bot_kwargs = dict()
+        if args.profile:
+            bot_kwargs['profile'] = True
+        if args.metrics_port:
+            bot_kwargs['metrics_port'] = args.metrics_port
+        start(args.bot, args.debug, **bot_kwargs)
 
 
 if __name__ == "__main__":
@@ -19,7 +19,7 @@ async def global_checks(ctx):
         return False
     if ctx.bot.config.command_disabled(ctx):  # checks disabled commands/cogs in config
         return False
-    if await config_perm_check(ctx, 'administrator'):  # doesn't ignore admins even if configured to do so
+    if await config_perm_check(ctx, 'administrator', skip_bot_perms=True):  # doesn't ignore admins even if configured to do so
         return True
     if ctx.bot.config.is_ignored(ctx):  # checks ignored users/channels/roles in config
         return False
@@ -77,29 +77,18 @@ mod_or:
 """
 
 
-async def config_perm_check(ctx, permission):
-    if await bulbe_perm_check(ctx, 'admin'):
+async def config_perm_check(ctx, permission, skip_bot_perms=False):
+    if not skip_bot_perms and await bulbe_perm_check(ctx, 'admin'):
         return True
     try:
-        roles_users = ctx.bot.config.get_config(ctx.guild.id)['roles'][permission]
+        allowed = ctx.bot.config.has_permission(ctx, permission)
     except AttributeError:
         ctx.bot.logger.debug(f"AttributeError encountered in config_perm_check trying to access config for guild {ctx.guild.id if ctx.guild else None}.")
         return False
-    except KeyError:
-        ctx.bot.logger.debug(f"KeyError encountered trying to access {permission} permission for guild {ctx.guild.id if ctx.guild else None}.")
-        return False
-    except TypeError:
-        ctx.bot.logger.debug(f"TypeError encountered trying to access {permission} permission for guild {ctx.guild.id if ctx.guild else None}.")
-        return False
-    if not isinstance(roles_users, list):
+    if allowed is None:
         ctx.bot.logger.error(f"Command {ctx.command} tried to check {permission} but that is not a valid permission.")
         return False
-    if ctx.author.id in roles_users:
-        return True
-    for role in ctx.author.roles:
-        if role.id in roles_users:
-            return True
-    return False
+    return allowed
 
 
 async def guild_perm_check(ctx, perms, *, check=all):
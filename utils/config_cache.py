@@ -0,0 +1,162 @@
+"""
+Host-local cache of Bulbe's guild configs, shared by shard worker processes.
+
+When Bulbe runs as several workers (launcher.py --processes), the supervisor
+runs a ConfigCacheServer on a unix socket. Workers load their shards' guild configs
+from it at startup instead of each reading the whole table, and publish configs
+they edit, which the server pushes to every other worker.
+
+Messages are newline-delimited JSON:
+    {"op": "get_all"}                              worker -> server
+    {"op": "all", "configs": {guild_id: config}}   server -> worker
+    {"op": "error", "message": text}               server -> worker, when loading configs failed
+    {"op": "put", "guild": id, "config": config}   both ways
+"""
+
+import asyncio
+import decimal
+import json
+import os
+import threading
+
+
+# max size of one message (the full config dump sent to a worker at startup)
+STREAM_LIMIT = 2**26
+# seconds a worker waits for the config dump before falling back to reading the table itself
+GET_ALL_TIMEOUT = 120
+
+
+class ConfigCacheError(Exception):
+    pass
+
+
+def _default(o):
+    if isinstance(o, decimal.Decimal):
+        return int(o) if o == o.to_integral_value() else float(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def encode(message):
+    return (json.dumps(message, default=_default) + '\n').encode()
+
+
+class ConfigCacheServer:
+    def __init__(self, path, load, logger):
+        """
+        path: unix socket path to listen on
+        load: blocking callable returning {guild_id: config}, called once when the first worker asks for configs
+        """
+        self.path = path
+        self.logger = logger
+        self._load = load
+        self._configs = None
+        self._lock = None
+        self._clients = set()
+
+    async def _get_all(self):
+        async with self._lock:
+            if self._configs is None:
+                self.logger.info("Config cache: loading configs.")
+                data = await asyncio.get_event_loop().run_in_executor(None, self._load)
+                # round trip through JSON so stored configs look exactly like what workers send
+                self._configs = json.loads(encode({str(k): v for k, v in data.items()}))
+                self.logger.info(f"Config cache: loaded {len(self._configs)} configs.")
+        return self._configs
+
+    async def handle(self, reader, writer):
+        self._clients.add(writer)
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                if message['op'] == 'get_all':
+                    try:
+                        reply = {'op': 'all', 'configs': await self._get_all()}
+                    except Exception as e:
+                        # the worker falls back to the table instead of waiting on a dump that isn't coming
+                        self.logger.error("Config cache: error loading configs.", exc_info=True)
+                        reply = {'op': 'error', 'message': f"{e.__class__.__name__}: {e}"}
+                    writer.write(encode(reply))
+                    await writer.drain()
+                elif message['op'] == 'put':
+                    if self._configs is not None:
+                        self._configs[str(message['guild'])] = message['config']
+                    data = encode(message)
+                    for client in list(self._clients):
+                        if client is not writer:
+                            client.write(data)
+        except (ConnectionError, ValueError):
+            self.logger.error("Config cache: dropping client.", exc_info=True)
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    async def serve(self):
+        self._lock = asyncio.Lock()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = await asyncio.start_unix_server(self.handle, path=self.path, limit=STREAM_LIMIT)
+        self.logger.info(f"Config cache listening on {self.path}.")
+        async with server:
+            await server.serve_forever()
+
+    def start_thread(self):
+        """Runs the server on its own event loop in a daemon thread."""
+        thread = threading.Thread(target=asyncio.run, args=(self.serve(),), name="config-cache", daemon=True)
+        thread.start()
+        return thread
+
+
+class ConfigCacheClient:
+    def __init__(self, reader, writer, logger):
+        self.logger = logger
+        self.callback = None
+        self._reader = reader
+        self._writer = writer
+        self._pending = None
+        self._task = asyncio.ensure_future(self._listen())
+
+    @classmethod
+    async def connect(cls, path, logger):
+        reader, writer = await asyncio.open_unix_connection(path, limit=STREAM_LIMIT)
+        return cls(reader, writer, logger)
+
+    def _fail_pending(self, error):
+        if self._pending and not self._pending.done():
+            self._pending.set_exception(error)
+
+    async def _listen(self):
+        try:
+            async for line in self._reader:
+                message = json.loads(line)
+                if message['op'] == 'all' and self._pending and not self._pending.done():
+                    self._pending.set_result({int(k): v for k, v in message['configs'].items()})
+                elif message['op'] == 'error':
+                    self._fail_pending(ConfigCacheError(message['message']))
+                elif message['op'] == 'put' and self.callback:
+                    try:
+                        self.callback(int(message['guild']), message['config'])
+                    except Exception:
+                        self.logger.error("Error applying config update from cache.", exc_info=True)
+        except Exception:
+            self.logger.error("Error reading from config cache.", exc_info=True)
+        finally:
+            self._fail_pending(ConfigCacheError("Connection to config cache closed."))
+        self.logger.error("Connection to config cache closed.")
+
+    async def get_all(self):
+        """Returns every cached guild config as {guild_id: config}. Raises ConfigCacheError or asyncio.TimeoutError."""
+        if self._task.done():
+            raise ConfigCacheError("Connection to config cache closed.")
+        self._pending = asyncio.get_event_loop().create_future()
+        self._writer.write(encode({'op': 'get_all'}))
+        await self._writer.drain()
+        return await asyncio.wait_for(self._pending, GET_ALL_TIMEOUT)
+
+    async def publish(self, guild_id, config):
+        """Sends an edited config to the cache, which pushes it to every other worker."""
+        self._writer.write(encode({'op': 'put', 'guild': guild_id, 'config': config}))
+        await self._writer.drain()
+
+    async def close(self):
+        self._task.cancel()
+        self._writer.close()
@@ -1,39 +1,213 @@
 
 import boto3
 from boto3.dynamodb.conditions import Key, Attr
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+import time
+import random
+import asyncio
+import functools
+import threading
+from collections import defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor
 
 from utils.utility import module_logger, stream_logger
+from utils.histogram import Histogram
+
+
+REGION = 'us-east-2'
+MAX_WORKERS = 4
+
+# retries of throttled or failed calls, with exponential backoff and full jitter between attempts
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 0.05
+RETRY_MAX_DELAY = 2
+THROTTLE_ERRORS = {'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded'}
+RETRYABLE_ERRORS = THROTTLE_ERRORS | {'InternalServerError', 'ServiceUnavailable'}
+# connection failures and timeouts (EndpointConnectionError, ReadTimeoutError, ConnectionClosedError...),
+# which botocore would otherwise have retried itself
+NETWORK_ERRORS = (BotoConnectionError, HTTPClientError)
+# max size of BatchWriteItem requests
+BATCH_SIZE = 25
+# keys tracked for consumed capacity, so Table.hot_keys doesn't grow forever
+HOT_KEY_LIMIT = 1000
 
 
 class TableError(Exception):
     pass
 
 
+class ConditionFailed(TableError):
+    pass
+
+
 class Table:
-    def __init__(self, table_name, bot=None):
+    """
+    Wrapper around a DynamoDB table.
+
+    The plain methods (get, put, read, write...) are blocking boto3 calls.
+    Coroutines should use the awaitable versions (aget, aput, aread, awrite...),
+    which run the same calls on a bounded thread pool so a slow round trip
+    doesn't stall the event loop.
+
+    Every DynamoDB call goes through _call, which retries throttled requests
+    and records latency, consumed capacity and retries (see stats()).
+    """
+    def __init__(self, table_name, bot=None, max_workers=MAX_WORKERS, backend=None):
         if bot:
             self.logger = module_logger(bot.name, 'dynamodb')
         else:
             self.logger = stream_logger('dynamodb')
         self.name = table_name
-        self.resource = boto3.resource('dynamodb', region_name='us-east-2')
-        self.table = self.resource.Table(table_name)
+        # a utils.storage backend to use instead of DynamoDB, for tests and benchmarks
+        self._backend = backend
+        # boto3 resources aren't thread safe, so each executor thread gets its own
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"dynamodb-{table_name}")
+        # accounting, per DynamoDB operation (get_item, query...). Updated from executor threads, so guarded by _stats_lock
+        self._stats_lock = threading.Lock()
+        self.latency = defaultdict(Histogram)
+        self.capacity = Counter()
+        self.throttles = Counter()
+        self.retries = Counter()
+        self.errors = Counter()
+        # (primary key, sort key) or 'query <sort key>' -> consumed capacity units
+        self.hot_keys = Counter()
         self.primary_key = self.table.key_schema[0]['AttributeName']
         self.sort_key = self.table.key_schema[1]['AttributeName']
+        self.sort_key_index = self._find_sort_key_index()
+        if not self.sort_key_index:
+            self.logger.warning(f"No global secondary index on {self.sort_key} found for table {table_name}. "
+                                f"Bulk reads will fall back to scanning the table.")
         self.logger.debug(f"Dynamodb table initialized. ({table_name})")
 
-    def put(self, data, key_data=None):
+    def _find_sort_key_index(self):
+        """Returns the name of a GSI partitioned on this table's sort key, if one exists."""
+        for index in self.table.global_secondary_indexes or []:
+            key_schema = index['KeySchema']
+            if key_schema[0]['AttributeName'] == self.sort_key and index['Projection']['ProjectionType'] == 'ALL':
+                return index['IndexName']
+        return None
+
+    @property
+    def resource(self):
+        if self._backend is not None:
+            return self._backend
+        resource = getattr(self._local, 'resource', None)
+        if resource is None:
+            # botocore's own retries are turned off so every throttle and network error goes through _call's backoff and accounting
+            config = Config(retries={'total_max_attempts': 1})
+            # a session per thread too, creating resources from boto3's shared default session isn't thread safe
+            session = boto3.session.Session()
+            resource = self._local.resource = session.resource('dynamodb', region_name=REGION, config=config)
+        return resource
+
+    @property
+    def table(self):
+        table = getattr(self._local, 'table', None)
+        if table is None:
+            table = self._local.table = self.resource.Table(self.name)
+        return table
+
+    def _call(self, method, hot_key=None, **kwargs):
+        """Makes one DynamoDB call, retrying throttled requests and network errors with exponential backoff."""
+        operation = method.__name__
+        kwargs['ReturnConsumedCapacity'] = 'TOTAL'
+        for attempt in range(MAX_RETRIES + 1):
+            started = time.perf_counter()
+            try:
+                response = method(**kwargs)
+            except (ClientError,) + NETWORK_ERRORS as e:
+                if isinstance(e, ClientError):
+                    code = e.response.get('Error', {}).get('Code')
+                    retryable = code in RETRYABLE_ERRORS
+                else:
+                    code = e.__class__.__name__
+                    retryable = True
+                with self._stats_lock:
+                    self.latency[operation].record(time.perf_counter() - started)
+                    if code in THROTTLE_ERRORS:
+                        self.throttles[operation] += 1
+                    if not retryable or attempt == MAX_RETRIES:
+                        self.errors[operation] += 1
+                        raise
+                    self.retries[operation] += 1
+                self.logger.warning(f"{operation} on {self.name} failed with {code}, retrying (attempt {attempt + 1}).")
+                time.sleep(self._backoff(attempt))
+                continue
+            with self._stats_lock:
+                self.latency[operation].record(time.perf_counter() - started)
+                self._record_capacity(operation, response.get('ConsumedCapacity'), hot_key)
+            return response
+
+    @staticmethod
+    def _backoff(attempt):
+        return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+    def _record_capacity(self, operation, consumed, hot_key):
+        # a dict for single-table calls, a list of them for batch calls
+        for entry in consumed if isinstance(consumed, list) else [consumed] if consumed else []:
+            units = float(entry.get('CapacityUnits', 0))
+            self.capacity[operation] += units
+            if hot_key is not None:
+                self.hot_keys[hot_key] += units
+        if len(self.hot_keys) > HOT_KEY_LIMIT:
+            self.hot_keys = Counter(dict(self.hot_keys.most_common(HOT_KEY_LIMIT // 2)))
+
+    def stats(self):
+        """
+        Returns a snapshot of this table's accounting:
+        {operation: {calls, p50, p95, p99, latency (a Histogram copy), capacity, throttles, retries, errors}}.
+        """
+        with self._stats_lock:
+            return {operation: {
+                'latency': self._copy_histogram(histogram),
+                'calls': histogram.count,
+                'p50': histogram.percentile(0.5),
+                'p95': histogram.percentile(0.95),
+                'p99': histogram.percentile(0.99),
+                'capacity': self.capacity[operation],
+                'throttles': self.throttles[operation],
+                'retries': self.retries[operation],
+                'errors': self.errors[operation],
+            } for operation, histogram in self.latency.items()}
+
+    def hottest_keys(self, n):
+        """Returns the n keys that consumed the most capacity, as [(key, units)]."""
+        with self._stats_lock:
+            return self.hot_keys.most_common(n)
+
+    @staticmethod
+    def _copy_histogram(histogram):
+        copy = Histogram()
+        copy.merge(histogram)
+        return copy
+
+    async def run_in_executor(self, func, *args, **kwargs):
+        """Runs a blocking table call on this table's thread pool."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def close(self):
+        """Waits for pending calls to finish and shuts down the thread pool."""
+        self._executor.shutdown(wait=True)
+
+    def put(self, data, key_data=None, condition=None):
+        """Writes an item. If a condition (boto3.dynamodb.conditions) is given and fails, raises ConditionFailed."""
         self.logger.debug(f"Writing to table: {self.name} ({key_data if key_data else ''}) - {data}")
         if key_data is not None:
             for i, key in enumerate(key_data):
                 data[[self.primary_key, self.sort_key][i]] = key
-        # try:
-        self.table.put_item(Item=data)
+        kwargs = {'ConditionExpression': condition} if condition is not None else {}
+        try:
+            self._call(self.table.put_item, (data.get(self.primary_key), data.get(self.sort_key)), Item=data, **kwargs)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                raise ConditionFailed(f"Condition failed writing {key_data} to {self.name}.") from e
+            raise
         self.logger.debug("Successfully wrote to table.")
         return True
-        # except Exception as e:
-        #     self.logger.error(f"Error writing to table {self.name}:", exc_info=True)
-        #     return None
 
     def get(self, key_data):
         self.logger.debug(f"Reading table: {self.name} ({key_data})")
@@ -43,7 +217,7 @@ class Table:
             return None
         for i, key in enumerate(key_data):
             keys[[self.primary_key, self.sort_key][i]] = key
-        response = self.table.get_item(Key=keys)
+        response = self._call(self.table.get_item, tuple(key_data), Key=keys)
         item = response['Item']
         self.logger.debug("Successfully read table.")
         return item
@@ -51,33 +225,79 @@ class Table:
         #     self.logger.debug(f"Error reading table {self.name}:", exc_info=True)
         #     return None
 
+    def delete(self, key_data):
+        self.logger.debug(f"Deleting from table: {self.name} ({key_data})")
+        keys = dict()
+        for i, key in enumerate(key_data):
+            keys[[self.primary_key, self.sort_key][i]] = key
+        self._call(self.table.delete_item, tuple(key_data), Key=keys)
+        self.logger.debug("Successfully deleted from table.")
+        return True
+
+    def pop(self, key_data):
+        """Deletes an item and returns it, in one atomic call. Raises KeyError if there was no item."""
+        self.logger.debug(f"Popping from table: {self.name} ({key_data})")
+        keys = dict()
+        for i, key in enumerate(key_data):
+            keys[[self.primary_key, self.sort_key][i]] = key
+        response = self._call(self.table.delete_item, tuple(key_data), Key=keys, ReturnValues='ALL_OLD')
+        return response['Attributes']
+
+    def query(self, sort_key):
+        """
+        Yields every item with the given sort key, one page at a time.
+        Uses the sort key GSI when available so only matching items are read.
+        """
+        if self.sort_key_index:
+            kwargs = {'IndexName': self.sort_key_index, 'KeyConditionExpression': Key(self.sort_key).eq(sort_key)}
+            method = self.table.query
+        else:
+            kwargs = {'FilterExpression': Key(self.sort_key).eq(sort_key)}
+            method = self.table.scan
+        while True:
+            response = self._call(method, f"{method.__name__} {sort_key}", **kwargs)
+            yield from response['Items']
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
     def read(self, sort_key):
         self.logger.debug(f"Bulk reading table: {self.name} - {sort_key}.")
-        # try:
-        response = self.table.scan(FilterExpression=Key(self.sort_key).eq(sort_key))
-        items = response['Items']
-        self.logger.debug(f"Successfully bulk read table {self.name} - {sort_key}")
+        items = list(self.query(sort_key))
+        self.logger.debug(f"Successfully bulk read table {self.name} - {sort_key} ({len(items)} items)")
         return items
-        # except Exception as e:
-        #     self.logger.debug(f"Error reading table {self.name}:", exc_info=True)
-        #     return None
 
     def read_to_dict(self, sort_key):
-        response = self.read(sort_key)
         data = dict()
         key_schema = [self.primary_key, self.sort_key]
-        for item in response:
+        for item in self.query(sort_key):
             data[int(item.pop(key_schema[0]))] = item
             item.pop(key_schema[1])
         return data
 
     def write(self, items, sort_key=None):
-        self.logger.debug(f"Reading table: {self.name}")
-        with self.table.batch_writer() as batch:
-            for item in items:
-                if sort_key:
-                    item[self.sort_key] = sort_key
-                batch.put_item(Item=item)
+        self.logger.debug(f"Batch writing to table: {self.name}")
+        requests = list()
+        for item in items:
+            if sort_key:
+                item[self.sort_key] = sort_key
+            requests.append({'PutRequest': {'Item': item}})
+        for i in range(0, len(requests), BATCH_SIZE):
+            batch = requests[i:i + BATCH_SIZE]
+            attempt = 0
+            while batch:
+                response = self._call(self.resource.batch_write_item, f"batch_write_item {sort_key}", RequestItems={self.name: batch})
+                batch = response.get('UnprocessedItems', {}).get(self.name, [])
+                if batch:
+                    # unprocessed items mean the batch was partly throttled
+                    with self._stats_lock:
+                        self.throttles['batch_write_item'] += 1
+                        if attempt == MAX_RETRIES:
+                            self.errors['batch_write_item'] += 1
+                            raise TableError(f"{len(batch)} items still unprocessed after {MAX_RETRIES} retries.")
+                        self.retries['batch_write_item'] += 1
+                    time.sleep(self._backoff(attempt))
+                    attempt += 1
 
     def write_from_dict(self, data, sort_key):
         items = list()
@@ -87,6 +307,30 @@ class Table:
             items.append(value)
         self.write(items)
 
+    async def aput(self, data, key_data=None, condition=None):
+        return await self.run_in_executor(self.put, data, key_data, condition)
+
+    async def aget(self, key_data):
+        return await self.run_in_executor(self.get, key_data)
+
+    async def adelete(self, key_data):
+        return await self.run_in_executor(self.delete, key_data)
+
+    async def apop(self, key_data):
+        return await self.run_in_executor(self.pop, key_data)
+
+    async def aread(self, sort_key):
+        return await self.run_in_executor(self.read, sort_key)
+
+    async def aread_to_dict(self, sort_key):
+        return await self.run_in_executor(self.read_to_dict, sort_key)
+
+    async def awrite(self, items, sort_key=None):
+        return await self.run_in_executor(self.write, items, sort_key)
+
+    async def awrite_from_dict(self, data, sort_key):
+        return await self.run_in_executor(self.write_from_dict, data, sort_key)
+
 
 if __name__ == "__main__":
     table = Table("Bulbe")
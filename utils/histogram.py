@@ -0,0 +1,63 @@
+
+import bisect
+
+
+# bucket upper bounds in seconds: 1ms, growing by sqrt(2) per bucket up to ~65s, plus one overflow bucket
+BUCKETS = tuple(0.001 * 2 ** (i / 2) for i in range(33))
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram.
+
+    Cheap to record into and to merge, and stores as plain ints (DynamoDB doesn't take floats).
+    Percentiles are the upper bound of the bucket they fall in, so they're accurate to ~40%.
+    """
+    __slots__ = ('counts', 'count', 'total')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+
+    def percentile(self, q):
+        """Returns the latency below which a fraction q (0-1) of samples fall, or None if empty."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return BUCKETS[i] if i < len(BUCKETS) else float('inf')
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def to_dict(self):
+        # trailing empty buckets are dropped to keep stored items small
+        counts = list(self.counts)
+        while counts and not counts[-1]:
+            counts.pop()
+        return {'counts': counts, 'total_ms': round(self.total * 1000)}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        for i, n in enumerate(data.get('counts', [])):
+            histogram.counts[i] = int(n)
+        histogram.count = sum(histogram.counts)
+        histogram.total = int(data.get('total_ms', 0)) / 1000
+        return histogram
@@ -0,0 +1,132 @@
+"""
+Prometheus-style metrics endpoint for a RevBot, served on localhost so monitoring
+can scrape it without going through Discord.
+
+    GET http://127.0.0.1:<port>/metrics
+"""
+
+import datetime
+
+from aiohttp import web
+
+from utils.histogram import BUCKETS
+
+
+class MetricsWriter:
+    """Builds a response in the Prometheus text exposition format."""
+    def __init__(self):
+        self.lines = []
+        self._declared = set()
+
+    def _declare(self, name, kind, help_text):
+        if name not in self._declared:
+            self._declared.add(name)
+            self.lines.append(f"# HELP {name} {help_text}")
+            self.lines.append(f"# TYPE {name} {kind}")
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for value in labels.values())
+        return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+    @staticmethod
+    def _value(value):
+        # Prometheus spells these +Inf, -Inf and NaN
+        if value != value:
+            return 'NaN'
+        if value in (float('inf'), float('-inf')):
+            return '+Inf' if value > 0 else '-Inf'
+        return value
+
+    def gauge(self, name, value, help_text, **labels):
+        self._declare(name, 'gauge', help_text)
+        self.lines.append(f"{name}{self._labels(labels)} {self._value(value)}")
+
+    def counter(self, name, value, help_text, **labels):
+        self._declare(name, 'counter', help_text)
+        self.lines.append(f"{name}{self._labels(labels)} {self._value(value)}")
+
+    def histogram(self, name, histogram, help_text, **labels):
+        self._declare(name, 'histogram', help_text)
+        cumulative = 0
+        for bound, n in zip(BUCKETS, histogram.counts):
+            cumulative += n
+            self.lines.append(f"{name}_bucket{self._labels({**labels, 'le': f'{bound:.4g}'})} {cumulative}")
+        self.lines.append(f"{name}_bucket{self._labels({**labels, 'le': '+Inf'})} {histogram.count}")
+        self.lines.append(f"{name}_sum{self._labels(labels)} {histogram.total}")
+        self.lines.append(f"{name}_count{self._labels(labels)} {histogram.count}")
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def collect(bot):
+    """Returns the bot's current metrics as Prometheus text."""
+    metrics = MetricsWriter()
+    metrics.gauge('revbot_uptime_seconds', (datetime.datetime.now() - bot.started_at).total_seconds(), "Seconds since the bot was initialized.")
+
+    for shard_id, latency in sorted(bot.latencies):
+        metrics.gauge('revbot_gateway_latency_seconds', latency, "Gateway heartbeat latency.", shard=shard_id)
+    metrics.gauge('revbot_loop_lag_seconds', bot.loop_lag, "How far the event loop was behind schedule at the last watchdog tick.")
+
+    # a family's lines must all follow its HELP/TYPE header, so each loop writes one family
+    if stats := bot.get_cog('Stats'):
+        totals = sorted(stats.totals.items())
+        for command, command_stats in totals:
+            metrics.counter('revbot_commands_total', command_stats.uses, "Commands invoked.", command=command)
+        for command, command_stats in totals:
+            metrics.counter('revbot_command_errors_total', command_stats.errors, "Commands that raised an error.", command=command)
+        for command, command_stats in totals:
+            metrics.histogram('revbot_command_latency_seconds', command_stats.latency, "Command latency.", command=command)
+
+    if table := getattr(bot, 'table', None):
+        # executor threads update the table's accounting, so read it from one locked snapshot
+        table_stats = sorted(table.stats().items())
+        for operation, s in table_stats:
+            metrics.histogram('revbot_dynamodb_latency_seconds', s['latency'], "DynamoDB call latency.",
+                              table=table.name, operation=operation)
+        for name, key, help_text in (
+                ('revbot_dynamodb_consumed_capacity_total', 'capacity', "Consumed capacity units."),
+                ('revbot_dynamodb_throttles_total', 'throttles', "Throttled DynamoDB calls."),
+                ('revbot_dynamodb_retries_total', 'retries', "Retried DynamoDB calls."),
+                ('revbot_dynamodb_errors_total', 'errors', "DynamoDB calls that failed after retrying.")):
+            for operation, s in table_stats:
+                metrics.counter(name, s[key], help_text, table=table.name, operation=operation)
+
+    for cache, size in bot.cache_sizes().items():
+        metrics.gauge('revbot_cache_size', size, "Number of items in an in-memory cache.", cache=cache)
+
+    try:
+        import psutil  # optional, only the RSS metric needs it
+    except ImportError:
+        pass
+    else:
+        metrics.gauge('revbot_resident_memory_bytes', psutil.Process().memory_info().rss, "Resident set size.")
+
+    return metrics.render()
+
+
+class MetricsServer:
+    def __init__(self, bot, port, host='127.0.0.1'):
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def handle_metrics(self, request):
+        return web.Response(text=collect(self.bot), content_type='text/plain', charset='utf-8')
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.bot.logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics.")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
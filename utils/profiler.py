@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import re
+import time
+from collections import Counter
+
+
+# seconds between event loop lag samples
+SAMPLE_INTERVAL = 0.5
+# callbacks (and lag samples) longer than this count as blocking
+SLOW_CALLBACK_THRESHOLD = 0.1
+
+# asyncio's slow callback warning looks like "Executing <Task pending name='...' coro=<Cog.method() ...>> took 0.512 seconds".
+# RevBot names the tasks it runs events and commands in, which says more than the outermost coroutine.
+name_pattern = re.compile(r"name='((?:event|command) [^']+)'")
+coro_pattern = re.compile(r"coro=<([\w.<>]+)\(")
+
+
+class _SlowCallbackHandler(logging.Handler):
+    """Feeds asyncio's debug-mode slow callback warnings to a LoopProfiler."""
+    def __init__(self, profiler):
+        super().__init__(logging.WARNING)
+        self.profiler = profiler
+
+    def emit(self, record):
+        if not record.msg.startswith('Executing %s took'):
+            return
+        handle, duration = record.args
+        match = name_pattern.search(str(handle)) or coro_pattern.search(str(handle))
+        self.profiler.slow_callback(match.group(1) if match else str(handle)[:80], duration)
+
+
+class LoopProfiler:
+    """
+    Opt-in profiler for blocking calls on a bot's event loop.
+
+    Samples event loop lag, turns on asyncio's slow callback detection, and attributes
+    blocked time both to the coroutine asyncio reports and to whatever commands were
+    running at the time (tracked with on_command/on_command_completion/on_command_error).
+    """
+    def __init__(self, bot, interval=SAMPLE_INTERVAL, threshold=SLOW_CALLBACK_THRESHOLD):
+        self.bot = bot
+        self.interval = interval
+        self.threshold = threshold
+        self.blocked = Counter()  # source -> seconds blocked
+        self.stalls = Counter()   # source -> number of times it blocked
+        self.max_lag = 0.0
+        self.samples = 0
+        self.started_at = None
+        self._active_commands = dict()  # message id -> command name
+        self._handler = _SlowCallbackHandler(self)
+        self._task = None
+        self._old_debug = None
+        self._old_slow_callback_duration = None
+
+    def start(self):
+        loop = self.bot.loop
+        self._old_debug, self._old_slow_callback_duration = loop.get_debug(), loop.slow_callback_duration
+        loop.set_debug(True)
+        loop.slow_callback_duration = self.threshold
+        logging.getLogger('asyncio').addHandler(self._handler)
+        self.bot.add_listener(self.on_command)
+        self.bot.add_listener(self.on_command_completion)
+        self.bot.add_listener(self.on_command_error)
+        self.started_at = time.monotonic()
+        self._task = loop.create_task(self._sample())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        loop = self.bot.loop
+        loop.set_debug(self._old_debug)
+        loop.slow_callback_duration = self._old_slow_callback_duration
+        logging.getLogger('asyncio').removeHandler(self._handler)
+        self.bot.remove_listener(self.on_command)
+        self.bot.remove_listener(self.on_command_completion)
+        self.bot.remove_listener(self.on_command_error)
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    async def _sample(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - before - self.interval
+            self.samples += 1
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self._attribute_to_commands(lag)
+
+    def _attribute_to_commands(self, seconds):
+        for name in set(self._active_commands.values()) or ['(no command running)']:
+            self.blocked[f"during {name}"] += seconds
+            self.stalls[f"during {name}"] += 1
+
+    def slow_callback(self, source, seconds):
+        self.blocked[source] += seconds
+        self.stalls[source] += 1
+
+    async def on_command(self, ctx):
+        self._active_commands[ctx.message.id] = f"command {ctx.command.qualified_name}"
+
+    async def on_command_completion(self, ctx):
+        self._active_commands.pop(ctx.message.id, None)
+
+    async def on_command_error(self, ctx, error):
+        self._active_commands.pop(ctx.message.id, None)
+
+    def report(self, n=10):
+        """Returns the top n sources of blocked time as lines of text."""
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0
+        lines = [f"Profiling for {elapsed:.0f}s, {self.samples} lag samples, max lag {self.max_lag:.3f}s."]
+        for source, seconds in self.blocked.most_common(n):
+            lines.append(f"{seconds:8.3f}s  {self.stalls[source]:5d}x  {source}")
+        return lines
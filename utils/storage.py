@@ -0,0 +1,330 @@
+"""
+In-process stand-ins for DynamoDB, so utils.db.Table can be tested and benchmarked offline.
+
+A backend looks like the parts of a boto3 DynamoDB service resource that Table uses:
+backend.Table(name) returns an object with key_schema, global_secondary_indexes,
+get_item, put_item, delete_item, query and scan, and backend.batch_write_item takes
+the same RequestItems. Responses mimic DynamoDB's: numbers come back as Decimal,
+floats are rejected, query/scan pages stop at 1MB, failed conditions raise
+ConditionalCheckFailedException, and ConsumedCapacity is estimated from item size.
+
+    Table('Bulbe', backend=MemoryBackend())
+    Table('Bulbe', backend=SQLiteBackend('bulbe.db'))
+"""
+
+import json
+import math
+import decimal
+import sqlite3
+import threading
+
+from boto3.dynamodb.conditions import AttributeBase
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+from botocore.exceptions import ClientError
+
+
+# key attribute names used by the bots' tables
+DEFAULT_KEY_SCHEMA = ('snowflake', 'dataType')
+# DynamoDB's limits
+PAGE_SIZE = 2**20
+BATCH_SIZE = 25
+ITEM_SIZE_LIMIT = 400 * 1024
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def dump(item):
+    """Serializes an item the way DynamoDB stores it. Raises TypeError for floats, like boto3."""
+    return json.dumps({key: _serializer.serialize(value) for key, value in item.items()}, sort_keys=True)
+
+
+def load(data):
+    return {key: _deserializer.deserialize(value) for key, value in json.loads(data).items()}
+
+
+def _size(value):
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, decimal.Decimal)):
+        # roughly one byte per two significant digits, plus one
+        return (len(str(abs(value))) + 1) // 2 + 1
+    if isinstance(value, dict):
+        return 3 + sum(len(key.encode()) + _size(v) + 1 for key, v in value.items())
+    return 3 + sum(_size(v) + 1 for v in value)
+
+
+def item_size(item):
+    """Approximates an item's size the way DynamoDB counts it, for the item size limit and capacity units."""
+    return sum(len(key.encode()) + _size(value) for key, value in item.items())
+
+
+def _client_error(code, operation, message):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+def _read_units(size):
+    # eventually consistent reads: half a unit per 4KB
+    return math.ceil(max(size, 1) / 4096) * 0.5
+
+
+def _write_units(size):
+    return float(math.ceil(max(size, 1) / 1024))
+
+
+def _operand(value, item):
+    return item.get(value.name) if isinstance(value, AttributeBase) else value
+
+
+def evaluate(condition, item):
+    """Evaluates a boto3.dynamodb.conditions expression (Key(...).eq(...), Attr(...).exists()...) against an item."""
+    expression = condition.get_expression()
+    operator, values = expression['operator'], expression['values']
+    if operator == 'AND':
+        return all(evaluate(value, item) for value in values)
+    if operator == 'OR':
+        return any(evaluate(value, item) for value in values)
+    if operator == 'NOT':
+        return not evaluate(values[0], item)
+    if operator == 'attribute_exists':
+        return values[0].name in item
+    if operator == 'attribute_not_exists':
+        return values[0].name not in item
+    operands = [_operand(value, item) for value in values]
+    if operands[0] is None:
+        return False
+    if operator == 'begins_with':
+        return operands[0].startswith(operands[1])
+    if operator == 'contains':
+        return operands[1] in operands[0]
+    if operator == 'BETWEEN':
+        return operands[1] <= operands[0] <= operands[2]
+    if operator == 'IN':
+        return operands[0] in values[1]
+    comparisons = {
+        '=': lambda a, b: a == b,
+        '<>': lambda a, b: a != b,
+        '<': lambda a, b: a < b,
+        '<=': lambda a, b: a <= b,
+        '>': lambda a, b: a > b,
+        '>=': lambda a, b: a >= b,
+    }
+    if operator not in comparisons:
+        raise NotImplementedError(f"Condition operator {operator} isn't supported by local backends.")
+    return comparisons[operator](*operands)
+
+
+class LocalTable:
+    """The boto3 Table resource methods Table uses, backed by a LocalBackend."""
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+        self.key_schema = [{'AttributeName': backend.key_schema[0], 'KeyType': 'HASH'},
+                           {'AttributeName': backend.key_schema[1], 'KeyType': 'RANGE'}]
+        self.global_secondary_indexes = None
+        if backend.sort_key_index:
+            self.global_secondary_indexes = [{
+                'IndexName': f"{backend.key_schema[1]}-index",
+                'KeySchema': [{'AttributeName': backend.key_schema[1], 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'ALL'},
+            }]
+
+    def _key(self, item, operation):
+        try:
+            return tuple(json.dumps(_serializer.serialize(item[name])) for name in self.backend.key_schema)
+        except KeyError:
+            raise _client_error('ValidationException', operation, "The provided key element does not match the schema")
+
+    def _capacity(self, units):
+        return {'TableName': self.name, 'CapacityUnits': units}
+
+    def get_item(self, Key, **kwargs):
+        data = self.backend.get(self.name, self._key(Key, 'GetItem'))
+        if data is None:
+            return {'ConsumedCapacity': self._capacity(_read_units(0))}
+        item = load(data)
+        return {'Item': item, 'ConsumedCapacity': self._capacity(_read_units(item_size(item)))}
+
+    def put_item(self, Item, ConditionExpression=None, **kwargs):
+        size = item_size(Item)
+        if size > ITEM_SIZE_LIMIT:
+            raise _client_error('ValidationException', 'PutItem', "Item size has exceeded the maximum allowed size")
+        data = dump(Item)
+        key = self._key(Item, 'PutItem')
+        with self.backend.lock:
+            if ConditionExpression is not None:
+                existing = self.backend.get(self.name, key)
+                if not evaluate(ConditionExpression, load(existing) if existing else {}):
+                    raise _client_error('ConditionalCheckFailedException', 'PutItem', "The conditional request failed")
+            self.backend.put(self.name, key, data)
+        return {'ConsumedCapacity': self._capacity(_write_units(size))}
+
+    def delete_item(self, Key, ConditionExpression=None, ReturnValues='NONE', **kwargs):
+        key = self._key(Key, 'DeleteItem')
+        with self.backend.lock:
+            existing = self.backend.get(self.name, key)
+            old = load(existing) if existing else None
+            if ConditionExpression is not None and not evaluate(ConditionExpression, old or {}):
+                raise _client_error('ConditionalCheckFailedException', 'DeleteItem', "The conditional request failed")
+            self.backend.delete(self.name, key)
+        response = {'ConsumedCapacity': self._capacity(_write_units(item_size(old) if old else 0))}
+        if old and ReturnValues == 'ALL_OLD':
+            response['Attributes'] = old
+        return response
+
+    def _sort_key_value(self, condition):
+        """If condition is `sort key = value`, returns the value serialized like a stored key, so backends can skip other items."""
+        expression = condition.get_expression()
+        values = expression['values']
+        if expression['operator'] == '=' and isinstance(values[0], AttributeBase) and values[0].name == self.backend.key_schema[1]:
+            return json.dumps(_serializer.serialize(values[1]))
+        return None
+
+    def _page(self, condition, filter_expression, start_key, limit):
+        start = self._key(start_key, 'Query') if start_key else None
+        sort_key = self._sort_key_value(condition) if condition is not None else None
+        items = []
+        size = 0
+        last_key = None
+        for key, data in self.backend.items(self.name, start, sort_key):
+            last_key = key
+            item = load(data)
+            size += item_size(item)
+            if (condition is None or evaluate(condition, item)) and \
+                    (filter_expression is None or evaluate(filter_expression, item)):
+                items.append(item)
+            if size >= PAGE_SIZE or (limit and len(items) >= limit):
+                break
+        else:
+            last_key = None
+        response = {'Items': items, 'Count': len(items), 'ConsumedCapacity': self._capacity(_read_units(size))}
+        if last_key is not None:
+            response['LastEvaluatedKey'] = {name: _deserializer.deserialize(json.loads(value))
+                                            for name, value in zip(self.backend.key_schema, last_key)}
+        return response
+
+    def query(self, KeyConditionExpression, FilterExpression=None, ExclusiveStartKey=None, Limit=None, **kwargs):
+        return self._page(KeyConditionExpression, FilterExpression, ExclusiveStartKey, Limit)
+
+    def scan(self, FilterExpression=None, ExclusiveStartKey=None, Limit=None, **kwargs):
+        return self._page(None, FilterExpression, ExclusiveStartKey, Limit)
+
+
+class LocalBackend:
+    """Base class for local backends. Subclasses store serialized items with get/put/delete/items."""
+    def __init__(self, key_schema=DEFAULT_KEY_SCHEMA, sort_key_index=True):
+        self.key_schema = key_schema
+        # whether tables have a GSI on the sort key, so Table.query can use it instead of scanning
+        self.sort_key_index = sort_key_index
+        # held for conditional writes, which read before writing
+        self.lock = threading.RLock()
+        self._tables = dict()
+
+    def Table(self, name):
+        if name not in self._tables:
+            self._tables[name] = LocalTable(self, name)
+        return self._tables[name]
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        if sum(len(requests) for requests in RequestItems.values()) > BATCH_SIZE:
+            raise _client_error('ValidationException', 'BatchWriteItem', "Too many items requested for the BatchWriteItem call")
+        capacity = []
+        for name, requests in RequestItems.items():
+            table = self.Table(name)
+            units = 0
+            for request in requests:
+                if 'PutRequest' in request:
+                    units += table.put_item(request['PutRequest']['Item'])['ConsumedCapacity']['CapacityUnits']
+                else:
+                    units += table.delete_item(request['DeleteRequest']['Key'])['ConsumedCapacity']['CapacityUnits']
+            capacity.append({'TableName': name, 'CapacityUnits': units})
+        return {'UnprocessedItems': {}, 'ConsumedCapacity': capacity}
+
+    def get(self, table, key):
+        raise NotImplementedError
+
+    def put(self, table, key, data):
+        raise NotImplementedError
+
+    def delete(self, table, key):
+        raise NotImplementedError
+
+    def items(self, table, start=None, sort_key=None):
+        """Yields (key, data) in key order, starting after `start`, only for items with this sort key if given."""
+        raise NotImplementedError
+
+
+class MemoryBackend(LocalBackend):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._items = dict()  # table name -> {key: data}
+
+    def get(self, table, key):
+        return self._items.get(table, {}).get(key)
+
+    def put(self, table, key, data):
+        self._items.setdefault(table, {})[key] = data
+
+    def delete(self, table, key):
+        self._items.get(table, {}).pop(key, None)
+
+    def items(self, table, start=None, sort_key=None):
+        with self.lock:
+            items = sorted(self._items.get(table, {}).items())
+        for key, data in items:
+            if (start is None or key > start) and (sort_key is None or key[1] == sort_key):
+                yield key, data
+
+
+class SQLiteBackend(LocalBackend):
+    def __init__(self, path=':memory:', **kwargs):
+        super().__init__(**kwargs)
+        # Table calls come from its executor threads, so one connection is shared under the lock
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("CREATE TABLE IF NOT EXISTS items "
+                         "(tbl TEXT, pk TEXT, sk TEXT, data TEXT, PRIMARY KEY (tbl, pk, sk))")
+        # plays the part of the sort key GSI
+        self._db.execute("CREATE INDEX IF NOT EXISTS items_by_sort_key ON items (tbl, sk, pk)")
+
+    def get(self, table, key):
+        with self.lock:
+            row = self._db.execute("SELECT data FROM items WHERE tbl = ? AND pk = ? AND sk = ?", (table, *key)).fetchone()
+        return row[0] if row else None
+
+    def put(self, table, key, data):
+        with self.lock:
+            self._db.execute("INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?)", (table, *key, data))
+
+    def delete(self, table, key):
+        with self.lock:
+            self._db.execute("DELETE FROM items WHERE tbl = ? AND pk = ? AND sk = ?", (table, *key))
+
+    def items(self, table, start=None, sort_key=None):
+        query = "SELECT pk, sk, data FROM items WHERE tbl = ?"
+        args = [table]
+        if start is not None:
+            query += " AND (pk, sk) > (?, ?)"
+            args.extend(start)
+        if sort_key is not None:
+            query += " AND sk = ?"
+            args.append(sort_key)
+        with self.lock:
+            rows = self._db.execute(query + " ORDER BY pk, sk", args).fetchall()
+        for pk, sk, data in rows:
+            yield (pk, sk), data
+
+    def close(self):
+        self._db.close()
+
+
+def open_backend(spec):
+    """Returns a backend from a spec string: 'memory' or 'sqlite:<path>'."""
+    if spec == 'memory':
+        return MemoryBackend()
+    if spec.startswith('sqlite:'):
+        return SQLiteBackend(spec[len('sqlite:'):])
+    raise ValueError(f"Unknown storage backend {spec!r}.")
@@ -2,8 +2,11 @@ import discord
 from discord.ext import commands
 
 import logging
+import logging.handlers
+import os
 import sys
-import datetime
+import queue
+import atexit
 import enum
 
 
@@ -36,66 +39,131 @@ def list_by_category(guild):
     return channels
 
 
-def setup_logger(name, level=logging.INFO):
-    logger = logging.getLogger(name)
-    d = datetime.datetime.now()
-    time = f"{d.month}-{d.day}_{d.hour}h{d.minute}m"
+# log files rotate when they reach this size, keeping this many old files
+LOG_MAX_BYTES = 10 * 2**20
+LOG_BACKUP_COUNT = 10
 
-    if sys.platform == 'linux':
-        filename = HOME_DIR + '/logs/{}/{}.log'
-    else:
-        filename = '../RevBots/logs/{}/{}.log'
+_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_stream_handler = None
+_file_handlers = dict()
+_listeners = dict()
+_queue_handlers = dict()
+# set in shard worker processes, so each writes its own log file. logging can't share one rotating file between processes
+_worker_id = None
 
-    file_handler = logging.FileHandler(filename.format(name, time))
-    # file_handler.setLevel(level)
 
-    stream_handler = logging.StreamHandler(sys.stdout)
-    # stream_handler.setLevel(level)
+def set_log_worker(worker_id):
+    """Makes this process log to logs/<bot>/<bot>-w<worker_id>.log. Call before setting up any loggers."""
+    global _worker_id
+    _worker_id = worker_id
+
+
+def _log_filename(name):
+    if sys.platform == 'linux':
+        filename = HOME_DIR + '/logs/{}/{}{}.log'
+    else:
+        filename = '../RevBots/logs/{}/{}{}.log'
+    return filename.format(name, name, f'-w{_worker_id}' if _worker_id is not None else '')
+
+
+def _get_file_handler(name):
+    if name not in _file_handlers:
+        handler = logging.handlers.RotatingFileHandler(_log_filename(name), maxBytes=LOG_MAX_BYTES,
+                                                       backupCount=LOG_BACKUP_COUNT)
+        handler.setFormatter(_formatter)
+        _file_handlers[name] = handler
+    return _file_handlers[name]
+
+
+def _get_stream_handler():
+    global _stream_handler
+    if _stream_handler is None:
+        _stream_handler = logging.StreamHandler(sys.stdout)
+        _stream_handler.setFormatter(_formatter)
+    return _stream_handler
+
+
+def _queue_handler(name, stream=True, file=True):
+    """
+    Returns the QueueHandler feeding a background listener thread, which does the
+    actual file/stdout writes so logging never blocks the event loop.
+    There's one per (bot, sinks) combination, shared by every logger that uses it.
+    """
+    key = (name, stream, file)
+    if key in _queue_handlers:
+        return _queue_handlers[key]
+    if key not in _listeners:
+        handlers = []
+        if file:
+            handlers.append(_get_file_handler(name))
+        if stream:
+            handlers.append(_get_stream_handler())
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        _listeners[key] = listener
+    handler = _queue_handlers[key] = logging.handlers.QueueHandler(_listeners[key].queue)
+    return handler
+
+
+def _attach(logger, handler):
+    # loggers are global, so without this every cog reload would add another handler
+    if handler not in logger.handlers:
+        logger.addHandler(handler)
+
+
+def logging_stats():
+    """Counts of loggers, attached handlers, file sinks, listener threads and open file descriptors."""
+    loggers = [logging.getLogger(name) for name in logging.root.manager.loggerDict]
+    loggers = [logger for logger in loggers if isinstance(logger, logging.Logger)]
+    try:
+        fds = len(os.listdir('/proc/self/fd'))
+    except OSError:
+        fds = None
+    return {
+        'loggers': len(loggers),
+        'handlers': sum(len(logger.handlers) for logger in loggers),
+        'file sinks': len(_file_handlers),
+        'listeners': len(_listeners),
+        'open fds': fds,
+    }
+
+
+def stop_logging():
+    """Flushes queued records, stops the listener threads and detaches their queue handlers from loggers."""
+    handlers = set(_queue_handlers.values())
+    for logger in [logging.root] + list(logging.root.manager.loggerDict.values()):
+        if isinstance(logger, logging.Logger):
+            for handler in [h for h in logger.handlers if h in handlers]:
+                logger.removeHandler(handler)
+    for listener in _listeners.values():
+        listener.stop()
+    _listeners.clear()
+    _queue_handlers.clear()
+
+
+atexit.register(stop_logging)
 
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    stream_handler.setFormatter(formatter)
 
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
+def setup_logger(name, level=logging.INFO):
+    logger = logging.getLogger(name)
+    _attach(logger, _queue_handler(name))
     logger.setLevel(level)
     return logger
 
 
 def module_logger(name, extension, level=logging.DEBUG, stream=True, file=True):
     logger = logging.getLogger(extension)  # logger name is cog name
-    d = datetime.datetime.now()
-    time = f"{d.month}-{d.day}_{d.hour}h{d.minute}m"
-
-    if sys.platform == 'linux':
-        filename = HOME_DIR + '/logs/{}/{}.log'
-    else:
-        filename = '../RevBots/logs/{}/{}.log'
     # uses name to log in the same file as bot logger
-    file_handler = logging.FileHandler(filename.format(name, time))
-    # file_handler.setLevel(level)
-
-    stream_handler = logging.StreamHandler(sys.stdout)
-    # stream_handler.setLevel(level)
-
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    stream_handler.setFormatter(formatter)
-
-    if file:
-        logger.addHandler(file_handler)
-    if stream:
-        logger.addHandler(stream_handler)
+    if stream or file:
+        _attach(logger, _queue_handler(name, stream, file))
     logger.setLevel(level)
     return logger
 
 
 def stream_logger(name):
     logger = logging.getLogger(name)
-    stream_handler = logging.StreamHandler(sys.stdout)
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    stream_handler.setFormatter(formatter)
-    logger.addHandler(stream_handler)
+    _attach(logger, _queue_handler(None, stream=True, file=False))
     return logger
 
 